@@ -29,6 +29,18 @@ interface TripoSRApiService {
         @Path("filename") filename: String
     ): Response<ResponseBody>
     
+    @GET("api/lod/{jobId}")
+    suspend fun getLodManifest(
+        @Path("jobId") jobId: String
+    ): Response<LodManifestResponse>
+    
+    @Streaming
+    @GET("api/lod/{jobId}/{level}")
+    suspend fun downloadLod(
+        @Path("jobId") jobId: String,
+        @Path("level") level: Int
+    ): Response<ResponseBody>
+    
     @GET("api/preview/{jobId}")
     suspend fun getPreviewImages(
         @Path("jobId") jobId: String
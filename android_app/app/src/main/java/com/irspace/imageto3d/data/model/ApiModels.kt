@@ -57,6 +57,8 @@ data class JobResult(
     val objFile: String,
     @SerializedName("stl_file")
     val stlFile: String,
+    @SerializedName("glb_file")
+    val glbFile: String? = null,
     @SerializedName("video_file")
     val videoFile: String,
     @SerializedName("preview_images")
@@ -65,6 +67,8 @@ data class JobResult(
     val renderFrames: List<String>,
     @SerializedName("input_images")
     val inputImages: List<String>,
+    @SerializedName("lod_levels")
+    val lodLevels: List<LodLevel>? = null,
     @SerializedName("file_sizes")
     val fileSizes: FileSizes,
     val timestamp: Long
@@ -73,9 +77,29 @@ data class JobResult(
 data class FileSizes(
     val obj: Long,
     val stl: Long,
+    val glb: Long = 0,
     val video: Long
 )
 
+data class LodLevel(
+    val level: Int, // 0 is the coarsest
+    val filename: String,
+    val vertices: Int,
+    val faces: Int,
+    val size: Long,
+    val url: String
+)
+
+data class LodManifestResponse(
+    val success: Boolean,
+    @SerializedName("job_id")
+    val jobId: String? = null,
+    @SerializedName("level_count")
+    val levelCount: Int = 0,
+    val levels: List<LodLevel> = emptyList(),
+    val error: String? = null
+)
+
 data class LogEntry(
     val message: String,
     val timestamp: String,
@@ -118,6 +142,8 @@ data class GalleryItem(
     val objUrl: String,
     @SerializedName("stl_url")
     val stlUrl: String,
+    @SerializedName("glb_url")
+    val glbUrl: String? = null,
     @SerializedName("created_at")
     val createdAt: Long,
     @SerializedName("image_count")
@@ -156,6 +182,7 @@ data class GalleryItemDetail(
 data class FileInfo(
     val obj: FileDetail,
     val stl: FileDetail,
+    val glb: FileDetail? = null,
     val video: FileDetail
 )
 
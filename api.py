@@ -5,8 +5,6 @@ import os
 import time
 import threading
 import torch
-import rembg
-import trimesh
 import base64
 import numpy as np
 from io import BytesIO
@@ -16,6 +14,9 @@ from queue import Queue
 
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground, save_video
+from tsr.lod import build_lod_chain
+from tsr.mesh_export import export_mesh
+from tsr.serving import ModelLoader, warmup
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for Android app
@@ -38,15 +39,43 @@ processing_status = {}
 
 # Device and Model
 device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"🚀 Loading TSR model on {device}...")
-model = TSR.from_pretrained(
-    "stabilityai/TripoSR",
-    config_name="config.yaml",
-    weight_name="model.ckpt",
-)
-model.renderer.set_chunk_size(8192)
-model.to(device)
-print("✅ Model loaded successfully!")
+
+# Warm-up request run before the model reports ready, at the resolution used by
+# process_3d_generation. Set TSR_WARMUP=0 to skip it.
+WARMUP_ENABLED = os.environ.get("TSR_WARMUP", "1") != "0"
+WARMUP_RESOLUTION = 256
+
+def load_model():
+    print(f"🚀 Loading TSR model on {device}...")
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+        device=device,
+    )
+    model.renderer.set_chunk_size("auto")  # Tuned to available memory on first query
+    print("✅ Model loaded successfully!")
+    return model
+
+def warmup_model(model):
+    print(f"🔥 Warming up at marching cubes resolution {WARMUP_RESOLUTION}...")
+    warmup(model, device, resolution=WARMUP_RESOLUTION)
+    print("✅ Model warmed up!")
+
+# Loaded in the background so the server answers /api/health right away
+model_loader = ModelLoader(load_model, warmup_model if WARMUP_ENABLED else None).start()
+
+# Background removal session, rembg is imported and its model loaded on first use
+rembg_session = None
+rembg_lock = threading.Lock()
+
+def get_rembg_session():
+    global rembg_session
+    with rembg_lock:
+        if rembg_session is None:
+            import rembg
+            rembg_session = rembg.new_session()
+    return rembg_session
 
 # Timer class with progress tracking
 class Timer:
@@ -101,6 +130,38 @@ class Timer:
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def write_lod_chain(mesh, output_dir, full_filename):
+    """Write the level-of-detail chain (coarsest first) and its manifest"""
+    levels = []
+    for level, lod_mesh in enumerate(build_lod_chain(mesh)):
+        if lod_mesh is mesh:
+            filename = full_filename
+        else:
+            filename = f"mesh_lod{level}.glb"
+            export_mesh(lod_mesh.vertices, lod_mesh.faces,
+                        {"glb": os.path.join(output_dir, filename)})
+        levels.append({
+            'level': level,
+            'filename': filename,
+            'vertices': len(lod_mesh.vertices),
+            'faces': len(lod_mesh.faces),
+            'size': os.path.getsize(os.path.join(output_dir, filename))
+        })
+    with open(os.path.join(output_dir, 'lod.json'), 'w') as f:
+        json.dump(levels, f)
+    return levels
+
+def load_lod_manifest(job_id):
+    """Read the level-of-detail manifest of a job, with download URLs"""
+    manifest_path = os.path.join(app.config['OUTPUT_FOLDER'], job_id, 'lod.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        levels = json.load(f)
+    for level in levels:
+        level['url'] = f"/api/lod/{job_id}/{level['level']}"
+    return levels
+
 def process_3d_generation(job_id, image_paths):
     """Background task for 3D model generation with detailed progress tracking"""
     timer = Timer(job_id)
@@ -112,6 +173,10 @@ def process_3d_generation(job_id, image_paths):
             jobs[job_id]['progress'] = 5
         
         timer.log_progress("🌟 Starting 3D reconstruction process...")
+        if not model_loader.ready:
+            timer.log_progress("⏳ Waiting for the model to finish loading...")
+        model = model_loader.get()
+        
         timer.log_progress(f"📁 Processing {len(image_paths)} image(s)...")
         
         processed_images = []
@@ -132,8 +197,7 @@ def process_3d_generation(job_id, image_paths):
             # TSR processing
             timer.start(f"Processing image {i+1}")
             timer.log_progress(f"🎭 Removing background from image {i+1}...")
-            rembg_session = rembg.new_session()
-            image = remove_background(resized_image, rembg_session)
+            image = remove_background(resized_image, get_rembg_session())
             timer.log_progress(f"✨ Background removed from image {i+1}")
             
             timer.log_progress(f"🔄 Resizing foreground of image {i+1}...")
@@ -224,31 +288,45 @@ def process_3d_generation(job_id, image_paths):
         
         meshes = model.extract_mesh(fused_scene_codes, has_vertex_color=False)
         mesh_obj = os.path.join(output_dir, "mesh.obj")
-        meshes[0].export(mesh_obj)
+        stl_file = os.path.join(output_dir, "mesh.stl")
+        glb_file = os.path.join(output_dir, "mesh.glb")
+        
+        # The OBJ is required, STL and GLB are extras: log their failures
+        def on_export_error(fmt, e):
+            if fmt == "obj":
+                raise e
+            timer.log_progress(f"⚠️ {fmt.upper()} conversion failed: {str(e)}")
+            print(f"⚠️ {fmt.upper()} conversion failed: {e}")
+        
+        # Write OBJ, STL and GLB together straight from the extracted arrays
+        timer.log_progress("💾 Writing OBJ, STL and GLB files...")
+        file_sizes = export_mesh(
+            meshes[0].vertices, meshes[0].faces,
+            {"obj": mesh_obj, "stl": stl_file, "glb": glb_file},
+            on_error=on_export_error
+        )
         timer.log_progress("📦 OBJ file exported successfully")
+        for fmt in ("stl", "glb"):
+            if fmt in file_sizes:
+                timer.log_progress(f"✅ {fmt.upper()} file created successfully ({file_sizes[fmt]:,} bytes)")
         
-        # Convert to STL using trimesh
-        stl_file = os.path.join(output_dir, "mesh.stl")
-        try:
-            timer.log_progress("🔄 Converting to STL format...")
-            mesh_trimesh = trimesh.load(mesh_obj)
-            mesh_trimesh.export(stl_file)
-            
-            # Verify the STL file was created and has content
-            if os.path.exists(stl_file) and os.path.getsize(stl_file) > 0:
-                file_size = os.path.getsize(stl_file)
-                timer.log_progress(f"✅ STL file created successfully ({file_size:,} bytes)")
-            else:
-                timer.log_progress("⚠️ STL file creation failed - file is empty or missing")
-        except Exception as e:
-            timer.log_progress(f"⚠️ STL conversion failed: {str(e)}")
-            print(f"⚠️ STL conversion failed: {e}")
+        # Level-of-detail chain so clients can show a coarse model first
+        if "glb" in file_sizes:
+            try:
+                timer.log_progress("🪜 Building level-of-detail chain...")
+                lod_levels = write_lod_chain(meshes[0], output_dir, "mesh.glb")
+                timer.log_progress(f"✅ {len(lod_levels)} detail levels written "
+                                   f"({', '.join(str(l['faces']) for l in lod_levels)} faces)")
+            except Exception as e:
+                timer.log_progress(f"⚠️ Level-of-detail chain failed: {str(e)}")
+                print(f"⚠️ Level-of-detail chain failed: {e}")
         
         timer.end("Exporting mesh")
         
         # Get file sizes
-        obj_size = os.path.getsize(mesh_obj)
-        stl_size = os.path.getsize(stl_file) if os.path.exists(stl_file) else 0
+        obj_size = file_sizes['obj']
+        stl_size = file_sizes.get('stl', 0)
+        glb_size = file_sizes.get('glb', 0)
         video_size = os.path.getsize(os.path.join(output_dir, "render.mp4"))
         
         # Count render frames
@@ -263,13 +341,16 @@ def process_3d_generation(job_id, image_paths):
                 'job_id': job_id,
                 'obj_file': f'/api/download/{job_id}/mesh.obj',
                 'stl_file': f'/api/download/{job_id}/mesh.stl',
+                'glb_file': f'/api/download/{job_id}/mesh.glb' if glb_size else None,
                 'video_file': f'/api/download/{job_id}/render.mp4',
                 'preview_images': [f'/api/download/{job_id}/preview_{i}.png' for i in range(8)],
                 'render_frames': render_frames,
                 'input_images': [f'/api/download/{job_id}/input_{i}.png' for i in range(len(image_paths))],
+                'lod_levels': load_lod_manifest(job_id),
                 'file_sizes': {
                     'obj': obj_size,
                     'stl': stl_size,
+                    'glb': glb_size,
                     'video': video_size
                 },
                 'timestamp': int(time.time())
@@ -292,14 +373,15 @@ def process_3d_generation(job_id, image_paths):
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint, 503 until the model is loaded and warmed up"""
     return jsonify({
-        'status': 'ok',
+        'status': model_loader.status,
+        'model_status': model_loader.health(),
         'message': 'TripoSR API is running',
         'device': device,
         'model': 'stabilityai/TripoSR',
         'version': '1.0.0'
-    }), 200
+    }), 200 if model_loader.ready else 503
 
 @app.route('/api/upload', methods=['POST'])
 def upload_images():
@@ -477,7 +559,7 @@ def download_file(job_id, filename):
     
     Parameters:
     - job_id: Job identifier
-    - filename: File to download (mesh.obj, mesh.stl, render.mp4, preview_N.png)
+    - filename: File to download (mesh.obj, mesh.stl, mesh.glb, render.mp4, preview_N.png)
     """
     output_dir = os.path.join(app.config['OUTPUT_FOLDER'], job_id)
     file_path = os.path.join(output_dir, filename)
@@ -490,6 +572,50 @@ def download_file(job_id, filename):
     
     return send_file(file_path, as_attachment=True)
 
+@app.route('/api/lod/<job_id>', methods=['GET'])
+def get_lod_manifest(job_id):
+    """
+    Get the level-of-detail chain of a job, ordered from coarsest to full detail
+    
+    Clients should download level 0 first for a quick preview and then fetch
+    the following levels as refinements.
+    
+    Response:
+    - Array of levels with face/vertex counts, size and download URL
+    """
+    levels = load_lod_manifest(job_id)
+    if levels is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'level_count': len(levels),
+        'levels': levels
+    }), 200
+
+@app.route('/api/lod/<job_id>/<int:level>', methods=['GET'])
+def download_lod(job_id, level):
+    """
+    Download a single level of the level-of-detail chain
+    
+    Parameters:
+    - job_id: Job identifier
+    - level: Detail level, 0 is the coarsest
+    """
+    levels = load_lod_manifest(job_id)
+    if levels is None or level >= len(levels):
+        return jsonify({
+            'success': False,
+            'error': 'Level not found'
+        }), 404
+    
+    file_path = os.path.join(app.config['OUTPUT_FOLDER'], job_id, levels[level]['filename'])
+    return send_file(file_path, as_attachment=True)
+
 @app.route('/api/preview/<job_id>', methods=['GET'])
 def get_preview_base64(job_id):
     """
@@ -654,6 +780,8 @@ def get_gallery():
             obj_size = os.path.getsize(obj_file) if os.path.exists(obj_file) else 0
             stl_file = os.path.join(folder_path, 'mesh.stl')
             stl_size = os.path.getsize(stl_file) if os.path.exists(stl_file) else 0
+            glb_file = os.path.join(folder_path, 'mesh.glb')
+            glb_size = os.path.getsize(glb_file) if os.path.exists(glb_file) else 0
             video_size = os.path.getsize(video_file) if os.path.exists(video_file) else 0
             
             # Count input images
@@ -689,12 +817,14 @@ def get_gallery():
                 'video_url': f'/api/download/{folder_name}/render.mp4',
                 'obj_url': f'/api/download/{folder_name}/mesh.obj',
                 'stl_url': f'/api/download/{folder_name}/mesh.stl',
+                'glb_url': f'/api/download/{folder_name}/mesh.glb' if glb_size else None,
                 'created_at': timestamp,
                 'image_count': len(input_images),
                 'status': job_data.get('status', 'completed'),
                 'file_sizes': {
                     'obj': obj_size,
                     'stl': stl_size,
+                    'glb': glb_size,
                     'video': video_size
                 },
                 'filenames': job_data.get('filenames', [])
@@ -740,6 +870,7 @@ def get_gallery_item(job_id):
     # Gather all files
     obj_file = os.path.join(output_dir, 'mesh.obj')
     stl_file = os.path.join(output_dir, 'mesh.stl')
+    glb_file = os.path.join(output_dir, 'mesh.glb')
     video_file = os.path.join(output_dir, 'render.mp4')
     
     # Input images
@@ -803,6 +934,11 @@ def get_gallery_item(job_id):
                 'size': os.path.getsize(stl_file) if os.path.exists(stl_file) else 0,
                 'exists': os.path.exists(stl_file)
             },
+            'glb': {
+                'url': f'/api/download/{job_id}/mesh.glb',
+                'size': os.path.getsize(glb_file) if os.path.exists(glb_file) else 0,
+                'exists': os.path.exists(glb_file)
+            },
             'video': {
                 'url': f'/api/download/{job_id}/render.mp4',
                 'size': os.path.getsize(video_file) if os.path.exists(video_file) else 0,
@@ -867,12 +1003,14 @@ if __name__ == '__main__':
     print(f"Model: stabilityai/TripoSR")
     print(f"API Base URL: http://0.0.0.0:5002/api")
     print("\n📡 Available Endpoints:")
-    print("  GET    /api/health                    - Health check")
+    print("  GET    /api/health                    - Health check (503 while the model loads)")
     print("  POST   /api/upload                    - Upload images (1-5)")
     print("  GET    /api/progress/<job_id>         - Real-time progress stream (SSE)")
     print("  GET    /api/status/<job_id>           - Get job status")
     print("  GET    /api/logs/<job_id>             - Get detailed logs")
     print("  GET    /api/download/<job_id>/<file>  - Download files")
+    print("  GET    /api/lod/<job_id>              - Level-of-detail manifest")
+    print("  GET    /api/lod/<job_id>/<level>      - Download a detail level (0 = coarsest)")
     print("  GET    /api/preview/<job_id>          - Get preview images (base64)")
     print("  GET    /api/renders/<job_id>          - Get all 30 render frames")
     print("  GET    /api/gallery                   - Get all completed 3D models")
@@ -882,6 +1020,8 @@ if __name__ == '__main__':
     print("\n📂 Output Files Per Job:")
     print("  • mesh.obj                - 3D model (OBJ format)")
     print("  • mesh.stl                - 3D model (STL format for 3D printing)")
+    print("  • mesh.glb                - 3D model (compact binary glTF for viewers)")
+    print("  • mesh_lod0.glb, ...      - Coarser detail levels (see lod.json)")
     print("  • render.mp4              - 360° rotation video")
     print("  • render_000.png to render_029.png - Individual frames")
     print("  • preview_0.png to preview_7.png   - Preview images")
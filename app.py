@@ -1,21 +1,18 @@
-from flask import Flask, request, render_template, send_from_directory, redirect, url_for, Response, session
+from flask import Flask, request, render_template, send_from_directory, redirect, url_for, Response, session, jsonify
 import os
 import torch
 from PIL import Image, ImageOps
 import numpy as np
 import time
-import rembg
 import json
 import threading
 from queue import Queue
 import shutil
 
-# Import trimesh for STL conversion
-import trimesh
-
-
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground, save_video
+from tsr.mesh_export import export_mesh
+from tsr.serving import ModelLoader, warmup
 
 app = Flask(__name__)
 app.secret_key = 'triposr-secret-key-2024'  # Required for sessions
@@ -31,16 +28,42 @@ processing_status = {}
 # Device
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-# Load model once on startup
-print("Initializing TSR model...")
-model = TSR.from_pretrained(
-    "stabilityai/TripoSR",
-    config_name="config.yaml",
-    weight_name="model.ckpt",
-)
-model.renderer.set_chunk_size(131072)  # Larger chunks = faster rendering
-model.to(device)
-print("Model loaded.")
+# Warm-up request at the resolution and vertex colors used by process_image_async.
+# Set TSR_WARMUP=0 to skip it.
+WARMUP_ENABLED = os.environ.get("TSR_WARMUP", "1") != "0"
+WARMUP_RESOLUTION = 350
+
+def load_model():
+    print("Initializing TSR model...")
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+        device=device,
+    )
+    model.renderer.set_chunk_size("auto")  # Tuned to available memory on first query
+    print("Model loaded.")
+    return model
+
+def warmup_model(model):
+    print("Warming up model...")
+    warmup(model, device, resolution=WARMUP_RESOLUTION, has_vertex_color=True)
+    print("Model warmed up.")
+
+# Load model once on startup, in the background so the server binds right away
+model_loader = ModelLoader(load_model, warmup_model if WARMUP_ENABLED else None).start()
+
+# Background removal session, rembg is imported and its model loaded on first use
+rembg_session = None
+rembg_lock = threading.Lock()
+
+def get_rembg_session():
+    global rembg_session
+    with rembg_lock:
+        if rembg_session is None:
+            import rembg
+            rembg_session = rembg.new_session()
+    return rembg_session
 
 # Timer class with progress tracking
 class Timer:
@@ -89,6 +112,9 @@ def process_image_async(upload_path, session_id):
     
     try:
         timer.log_progress("📁 Processing uploaded image...", step=1, total_steps=10)
+        if not model_loader.ready:
+            timer.log_progress("⏳ Waiting for the model to finish loading...", step=1, total_steps=10)
+        model = model_loader.get()
         
         # Open and resize with high-quality filter
         timer.log_progress("🖼️ Loading and optimizing image...", step=2, total_steps=10)
@@ -99,8 +125,7 @@ def process_image_async(upload_path, session_id):
         # TSR processing
         timer.start("Processing image")
         timer.log_progress("🎭 Removing background...", step=3, total_steps=10)
-        rembg_session = rembg.new_session()
-        image = remove_background(resized_image, rembg_session)
+        image = remove_background(resized_image, get_rembg_session())
         timer.log_progress("✨ Background removed successfully")
         
         timer.log_progress("🔄 Maximizing object scale...")
@@ -156,27 +181,28 @@ def process_image_async(upload_path, session_id):
         # Increased resolution to 350 (Max safe limit) and enabled vertex colors
         meshes = model.extract_mesh(scene_codes, resolution=350, has_vertex_color=True)
         mesh_file = os.path.join(image_dir, "mesh.obj")
-        meshes[0].export(mesh_file)
-        timer.log_progress("📦 OBJ file exported successfully")
-
-        # Convert to STL using trimesh
         stl_file = os.path.join(image_dir, "mesh.stl")
-        try:
-            timer.log_progress("🔄 Converting to STL format...")
-            # Load the OBJ file with trimesh
-            mesh_trimesh = trimesh.load(mesh_file)
-            # Export as STL
-            mesh_trimesh.export(stl_file)
-            
-            # Verify the STL file was created and has content
-            if os.path.exists(stl_file) and os.path.getsize(stl_file) > 0:
-                file_size = os.path.getsize(stl_file)
-                timer.log_progress(f"\u2705 STL file created successfully ({file_size:,} bytes)")
-            else:
-                timer.log_progress("\u26a0\ufe0f STL file creation failed - file is empty or missing")
-        except Exception as e:
-            timer.log_progress(f"\u26a0\ufe0f STL conversion failed: {str(e)}")
-            print(f"\u26a0\ufe0f STL conversion failed: {e}")
+        glb_file = os.path.join(image_dir, "mesh.glb")
+
+        # The OBJ is required, STL and GLB are extras: log their failures
+        def on_export_error(fmt, e):
+            if fmt == "obj":
+                raise e
+            timer.log_progress(f"\u26a0\ufe0f {fmt.upper()} conversion failed: {str(e)}")
+            print(f"\u26a0\ufe0f {fmt.upper()} conversion failed: {e}")
+
+        # Write OBJ, STL and GLB together straight from the extracted arrays
+        timer.log_progress("💾 Writing OBJ, STL and GLB files...")
+        file_sizes = export_mesh(
+            meshes[0].vertices,
+            meshes[0].faces,
+            {"obj": mesh_file, "stl": stl_file, "glb": glb_file},
+            vertex_colors=meshes[0].vertex_colors,
+            on_error=on_export_error,
+        )
+        timer.log_progress("📦 OBJ file exported successfully")
+        if "stl" in file_sizes:
+            timer.log_progress(f"\u2705 STL file created successfully ({file_sizes['stl']:,} bytes)")
         timer.end("Exporting mesh")
 
         # Mark as completed
@@ -246,6 +272,11 @@ def progress_stream(session_id):
                            'Connection': 'keep-alive',
                            'Access-Control-Allow-Origin': '*'})
 
+@app.route("/api/health")
+def health_check():
+    # 503 until the model is loaded and warmed up
+    return jsonify(model_loader.health()), 200 if model_loader.ready else 503
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
@@ -314,6 +345,7 @@ def result(folder):
         video_file="render.mp4",
         obj_file="mesh.obj",
         stl_file="mesh.stl",
+        glb_file="mesh.glb",
         previous_outputs=output_folders[:10]  # Limit to 10 most recent
     )
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Latency / quality benchmark for backbone token merging: runs the example image
+at several merge ratios and compares meshes and renders against the default
+(unmerged) model
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import torch
+from PIL import Image
+from tsr.system import TSR
+from tsr.utils import remove_background, resize_foreground
+from test_precision_regression import chamfer_distance, psnr, run_pipeline
+import rembg
+
+MERGE_RATIOS = [0.25, 0.5, 0.75]
+N_RUNS = 3
+
+
+def time_forward(model, image, device):
+    """Median scene code latency over N_RUNS runs, after one warm-up run"""
+    timings = []
+    with torch.no_grad():
+        for i in range(N_RUNS + 1):
+            if device == "cuda":
+                torch.cuda.synchronize()
+            start = time.time()
+            model([image], device=device)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            if i > 0:
+                timings.append(time.time() - start)
+    return float(np.median(timings))
+
+
+def benchmark_token_merge(ratios=MERGE_RATIOS):
+    print("🧪 Benchmarking backbone token merging")
+    print("=" * 50)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"🖥️  Using device: {device}")
+
+    print("📦 Loading TSR model...")
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+    )
+    model.renderer.set_chunk_size(8192)
+    model.to(device)
+    print("✅ Model loaded successfully")
+
+    test_image_path = "examples/chair.png"
+    if not os.path.exists(test_image_path):
+        print(f"❌ Test image not found: {test_image_path}")
+        return False
+
+    print("🎭 Preparing test image...")
+    rembg_session = rembg.new_session()
+    image = remove_background(Image.open(test_image_path), rembg_session)
+    image = resize_foreground(image, ratio=0.85)
+    image = np.array(image).astype(np.float32) / 255.0
+    image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+    image = Image.fromarray((image * 255.0).astype(np.uint8))
+
+    print("🧠 Running default model...")
+    model.backbone.set_token_merge(0.0)
+    ref_latency = time_forward(model, image, device)
+    ref_codes, ref_mesh, ref_renders = run_pipeline(model, image, device)
+
+    print(f"📊 {'ratio':>6} {'latency':>9} {'speedup':>8} {'chamfer':>9} {'PSNR':>7}")
+    print(f"📊 {0.0:>6.2f} {ref_latency:>8.2f}s {1.0:>7.2f}x {0.0:>9.2e} {'inf':>7}")
+    for ratio in ratios:
+        model.backbone.set_token_merge(ratio)
+        latency = time_forward(model, image, device)
+        codes, mesh, renders = run_pipeline(model, image, device)
+        chamfer = chamfer_distance(mesh.vertices, ref_mesh.vertices)
+        render_psnr = min(psnr(a, b) for a, b in zip(renders, ref_renders))
+        print(
+            f"📊 {ratio:>6.2f} {latency:>8.2f}s {ref_latency / latency:>7.2f}x "
+            f"{chamfer:>9.2e} {render_psnr:>6.1f}dB"
+        )
+    model.backbone.set_token_merge(0.0)
+    return True
+
+
+if __name__ == "__main__":
+    ratios = [float(r) for r in sys.argv[1:]] or MERGE_RATIOS
+    success = benchmark_token_merge(ratios)
+    sys.exit(0 if success else 1)
@@ -9,9 +9,11 @@ import rembg
 import torch
 from PIL import Image
 from functools import partial
+from fastapi.responses import JSONResponse
 
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground, to_gradio_3d_orientation
+from tsr.serving import ModelLoader, warmup
 
 import argparse
 
@@ -21,15 +23,33 @@ if torch.cuda.is_available():
 else:
     device = "cpu"
 
-model = TSR.from_pretrained(
-    "stabilityai/TripoSR",
-    config_name="config.yaml",
-    weight_name="model.ckpt",
-)
+# warm-up request at the default marching cubes resolution of the UI,
+# set TSR_WARMUP=0 to skip it
+WARMUP_ENABLED = os.environ.get("TSR_WARMUP", "1") != "0"
+WARMUP_RESOLUTION = 256
 
-# adjust the chunk size to balance between speed and memory usage
-model.renderer.set_chunk_size(8192)
-model.to(device)
+
+def load_model():
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+        device=device,
+    )
+
+    # pick the chunk size from a warm-up sweep within the available memory
+    model.renderer.set_chunk_size("auto")
+    return model
+
+
+def warmup_model(model):
+    warmup(model, device, resolution=WARMUP_RESOLUTION, has_vertex_color=True)
+
+
+# loaded in the background, requests wait for it
+model_loader = ModelLoader(
+    load_model, warmup_model if WARMUP_ENABLED else None
+).start()
 
 rembg_session = rembg.new_session()
 
@@ -59,6 +79,7 @@ def preprocess(input_image, do_remove_background, foreground_ratio):
 
 
 def generate(image, mc_resolution, formats=["obj", "glb"]):
+    model = model_loader.get()
     scene_codes = model(image, device=device)
     mesh = model.extract_mesh(scene_codes, True, resolution=mc_resolution)[0]
     mesh = to_gradio_3d_orientation(mesh)
@@ -183,5 +204,15 @@ if __name__ == '__main__':
         auth=(args.username, args.password) if (args.username and args.password) else None,
         share=args.share,
         server_name="0.0.0.0" if args.listen else None, 
-        server_port=args.port
-    )
\ No newline at end of file
+        server_port=args.port,
+        prevent_thread_lock=True,
+    )
+
+    # 503 until the model is loaded and warmed up
+    def health_check():
+        return JSONResponse(
+            model_loader.health(), status_code=200 if model_loader.ready else 503
+        )
+
+    interface.app.add_api_route("/api/health", health_check, methods=["GET"])
+    interface.block_thread()
\ No newline at end of file
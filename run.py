@@ -4,14 +4,14 @@ import os
 import time
 
 import numpy as np
-import rembg
 import torch
-import xatlas
 from PIL import Image
 
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground, save_video
 from tsr.bake_texture import bake_texture
+from tsr.mesh_export import export_mesh, write_glb
+from tsr.onnx_export import OnnxRuntimeBackend, export_onnx, onnx_exported
 
 
 class Timer:
@@ -40,152 +40,254 @@ class Timer:
 timer = Timer()
 
 
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-parser = argparse.ArgumentParser()
-parser.add_argument("image", type=str, nargs="+", help="Path to input image(s).")
-parser.add_argument(
-    "--device",
-    default="cuda:0",
-    type=str,
-    help="Device to use. If no CUDA-compatible device is found, will fallback to 'cpu'. Default: 'cuda:0'",
-)
-parser.add_argument(
-    "--pretrained-model-name-or-path",
-    default="stabilityai/TripoSR",
-    type=str,
-    help="Path to the pretrained model. Could be either a huggingface model id is or a local path. Default: 'stabilityai/TripoSR'",
-)
-parser.add_argument(
-    "--chunk-size",
-    default=8192,
-    type=int,
-    help="Evaluation chunk size for surface extraction and rendering. Smaller chunk size reduces VRAM usage but increases computation time. 0 for no chunking. Default: 8192",
-)
-parser.add_argument(
-    "--mc-resolution",
-    default=256,
-    type=int,
-    help="Marching cubes grid resolution. Default: 256"
-)
-parser.add_argument(
-    "--no-remove-bg",
-    action="store_true",
-    help="If specified, the background will NOT be automatically removed from the input image, and the input image should be an RGB image with gray background and properly-sized foreground. Default: false",
-)
-parser.add_argument(
-    "--foreground-ratio",
-    default=0.85,
-    type=float,
-    help="Ratio of the foreground size to the image size. Only used when --no-remove-bg is not specified. Default: 0.85",
-)
-parser.add_argument(
-    "--output-dir",
-    default="output/",
-    type=str,
-    help="Output directory to save the results. Default: 'output/'",
-)
-parser.add_argument(
-    "--model-save-format",
-    default="obj",
-    type=str,
-    choices=["obj", "glb"],
-    help="Format to save the extracted mesh. Default: 'obj'",
-)
-parser.add_argument(
-    "--bake-texture",
-    action="store_true",
-    help="Bake a texture atlas for the extracted mesh, instead of vertex colors",
-)
-parser.add_argument(
-    "--texture-resolution",
-    default=2048,
-    type=int,
-    help="Texture atlas resolution, only useful with --bake-texture. Default: 2048"
-)
-parser.add_argument(
-    "--render",
-    action="store_true",
-    help="If specified, save a NeRF-rendered video. Default: false",
-)
-args = parser.parse_args()
-
-output_dir = args.output_dir
-os.makedirs(output_dir, exist_ok=True)
-
-device = args.device
-if not torch.cuda.is_available():
-    device = "cpu"
-
-timer.start("Initializing model")
-model = TSR.from_pretrained(
-    args.pretrained_model_name_or_path,
-    config_name="config.yaml",
-    weight_name="model.ckpt",
-)
-model.renderer.set_chunk_size(args.chunk_size)
-model.to(device)
-timer.end("Initializing model")
-
-timer.start("Processing images")
-images = []
-
-if args.no_remove_bg:
-    rembg_session = None
-else:
-    rembg_session = rembg.new_session()
-
-for i, image_path in enumerate(args.image):
+def main():
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image", type=str, nargs="+", help="Path to input image(s).")
+    parser.add_argument(
+        "--device",
+        default="cuda:0",
+        type=str,
+        help="Device to use. If no CUDA-compatible device is found, will fallback to 'cpu'. Default: 'cuda:0'",
+    )
+    parser.add_argument(
+        "--precision",
+        default="fp32",
+        type=str,
+        choices=["fp32", "bf16", "fp16"],
+        help="Inference precision of the tokenizers, backbone and decoder. 'fp16' runs as bf16 on CPU. Default: 'fp32'",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Compile the decoder query and compositing with torch.compile. Compiled graphs are cached on disk, so only the first run pays the compile time. Default: false",
+    )
+    parser.add_argument(
+        "--onnx-dir",
+        default=None,
+        type=str,
+        help="Run the image-to-triplane network and the decoder with onnxruntime, using the ONNX graphs in this directory (exported on first use). Requires fp32 precision. Default: PyTorch",
+    )
+    parser.add_argument(
+        "--quantization",
+        default=None,
+        type=str,
+        choices=["int8"],
+        help="Dynamic int8 quantization of the backbone and decoder linear layers, CPU only. The quantized weights are cached next to the model config. Default: none",
+    )
+    parser.add_argument(
+        "--pretrained-model-name-or-path",
+        default="stabilityai/TripoSR",
+        type=str,
+        help="Path to the pretrained model. Could be either a huggingface model id is or a local path. Default: 'stabilityai/TripoSR'",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        default="8192",
+        type=str,
+        help="Evaluation chunk size for surface extraction and rendering. Smaller chunk size reduces VRAM usage but increases computation time. 0 for no chunking, 'auto' to tune it to the available memory. Default: 8192",
+    )
+    parser.add_argument(
+        "--attention-slice-size",
+        default=None,
+        type=int,
+        help="Compute backbone attention in slices of this many tokens. Bounds attention memory to grow linearly with the batch size, useful for CPU inference. Default: no slicing",
+    )
+    parser.add_argument(
+        "--prune-background",
+        action="store_true",
+        help="Drop image tokens that only cover the background (by the removed background's alpha, or the gray fill with --no-remove-bg), which speeds up the image encoder and cross-attention. Default: false",
+    )
+    parser.add_argument(
+        "--token-merge-ratio",
+        default=0.0,
+        type=float,
+        help="Fraction of similar triplane tokens to merge in every backbone layer. Faster, lower quality previews. Default: 0 (disabled)",
+    )
+    parser.add_argument(
+        "--mc-resolution",
+        default=256,
+        type=int,
+        help="Marching cubes grid resolution. Default: 256"
+    )
+    parser.add_argument(
+        "--no-remove-bg",
+        action="store_true",
+        help="If specified, the background will NOT be automatically removed from the input image, and the input image should be an RGB image with gray background and properly-sized foreground. Default: false",
+    )
+    parser.add_argument(
+        "--foreground-ratio",
+        default=0.85,
+        type=float,
+        help="Ratio of the foreground size to the image size. Only used when --no-remove-bg is not specified. Default: 0.85",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="output/",
+        type=str,
+        help="Output directory to save the results. Default: 'output/'",
+    )
+    parser.add_argument(
+        "--model-save-format",
+        default="obj",
+        type=str,
+        choices=["obj", "glb"],
+        help="Format to save the extracted mesh. Default: 'obj'",
+    )
+    parser.add_argument(
+        "--bake-texture",
+        action="store_true",
+        help="Bake a texture atlas for the extracted mesh, instead of vertex colors",
+    )
+    parser.add_argument(
+        "--texture-resolution",
+        default=2048,
+        type=int,
+        help="Texture atlas resolution, only useful with --bake-texture. Default: 2048"
+    )
+    parser.add_argument(
+        "--atlas-preset",
+        default="balanced",
+        type=str,
+        choices=["quality", "balanced", "fast"],
+        help="UV atlas packing preset trading packing quality for speed, only useful with --bake-texture. Default: 'balanced'",
+    )
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="If specified, save a NeRF-rendered video. Default: false",
+    )
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    device = args.device
+    if not torch.cuda.is_available():
+        device = "cpu"
+    if args.quantization is not None:
+        # dynamically quantized layers only have CPU kernels
+        device = "cpu"
+
+    timer.start("Initializing model")
+    model = TSR.from_pretrained(
+        args.pretrained_model_name_or_path,
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+        precision=args.precision,
+        quantization=args.quantization,
+        device=device,
+    )
+    model.renderer.set_chunk_size(
+        args.chunk_size if args.chunk_size == "auto" else int(args.chunk_size)
+    )
+    if args.prune_background:
+        model.image_tokenizer.set_background_pruning(True)
+    if args.token_merge_ratio > 0:
+        model.backbone.set_token_merge(args.token_merge_ratio)
+    if args.attention_slice_size is not None:
+        model.backbone.set_attention_processor("sliced", args.attention_slice_size)
+    if args.onnx_dir is not None:
+        if not onnx_exported(args.onnx_dir):
+            export_onnx(model, args.onnx_dir)
+        model.set_onnx_backend(OnnxRuntimeBackend(args.onnx_dir))
+    if args.compile:
+        model.renderer.enable_compile()
+    timer.end("Initializing model")
+
+    timer.start("Processing images")
+    images = []
+
     if args.no_remove_bg:
-        image = np.array(Image.open(image_path).convert("RGB"))
+        rembg_session = None
     else:
-        image = remove_background(Image.open(image_path), rembg_session)
-        image = resize_foreground(image, args.foreground_ratio)
-        image = np.array(image).astype(np.float32) / 255.0
-        image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
-        image = Image.fromarray((image * 255.0).astype(np.uint8))
-        if not os.path.exists(os.path.join(output_dir, str(i))):
-            os.makedirs(os.path.join(output_dir, str(i)))
-        image.save(os.path.join(output_dir, str(i), f"input.png"))
-    images.append(image)
-timer.end("Processing images")
-
-for i, image in enumerate(images):
-    logging.info(f"Running image {i + 1}/{len(images)} ...")
-
-    timer.start("Running model")
-    with torch.no_grad():
-        scene_codes = model([image], device=device)
-    timer.end("Running model")
-
-    if args.render:
-        timer.start("Rendering")
-        render_images = model.render(scene_codes, n_views=30, return_type="pil")
-        for ri, render_image in enumerate(render_images[0]):
-            render_image.save(os.path.join(output_dir, str(i), f"render_{ri:03d}.png"))
-        save_video(
-            render_images[0], os.path.join(output_dir, str(i), f"render.mp4"), fps=30
+        import rembg
+
+        rembg_session = rembg.new_session()
+
+    for i, image_path in enumerate(args.image):
+        if args.no_remove_bg:
+            image = np.array(Image.open(image_path).convert("RGB"))
+        else:
+            image = remove_background(Image.open(image_path), rembg_session)
+            rgba = resize_foreground(image, args.foreground_ratio)
+            image = np.array(rgba).astype(np.float32) / 255.0
+            image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+            image = Image.fromarray((image * 255.0).astype(np.uint8))
+            if not os.path.exists(os.path.join(output_dir, str(i))):
+                os.makedirs(os.path.join(output_dir, str(i)))
+            image.save(os.path.join(output_dir, str(i), f"input.png"))
+            if args.prune_background:
+                # the model composites RGBA itself and prunes by the alpha
+                image = rgba
+        images.append(image)
+    timer.end("Processing images")
+
+    for i, image in enumerate(images):
+        logging.info(f"Running image {i + 1}/{len(images)} ...")
+
+        timer.start("Running model")
+        with torch.no_grad():
+            scene_codes = model([image], device=device)
+        timer.end("Running model")
+
+        if args.render:
+            timer.start("Rendering")
+            render_images = model.render(scene_codes, n_views=30, return_type="pil")
+            for ri, render_image in enumerate(render_images[0]):
+                render_image.save(os.path.join(output_dir, str(i), f"render_{ri:03d}.png"))
+            save_video(
+                render_images[0], os.path.join(output_dir, str(i), f"render.mp4"), fps=30
+            )
+            timer.end("Rendering")
+
+        timer.start("Extracting mesh")
+        meshes = model.extract_mesh(
+            scene_codes,
+            not args.bake_texture,
+            resolution=args.mc_resolution,
+            has_vertex_normal=args.bake_texture,
         )
-        timer.end("Rendering")
+        timer.end("Extracting mesh")
 
-    timer.start("Extracting mesh")
-    meshes = model.extract_mesh(scene_codes, not args.bake_texture, resolution=args.mc_resolution)
-    timer.end("Extracting mesh")
+        out_mesh_path = os.path.join(output_dir, str(i), f"mesh.{args.model_save_format}")
+        if args.bake_texture:
+            out_texture_path = os.path.join(output_dir, str(i), "texture.png")
 
-    out_mesh_path = os.path.join(output_dir, str(i), f"mesh.{args.model_save_format}")
-    if args.bake_texture:
-        out_texture_path = os.path.join(output_dir, str(i), "texture.png")
+            timer.start("Baking texture")
+            bake_output = bake_texture(meshes[0], model, scene_codes[0], args.texture_resolution, args.atlas_preset)
+            timer.end("Baking texture")
 
-        timer.start("Baking texture")
-        bake_output = bake_texture(meshes[0], model, scene_codes[0], args.texture_resolution)
-        timer.end("Baking texture")
+            timer.start("Exporting mesh and texture")
+            if args.model_save_format == "glb":
+                write_glb(
+                    out_mesh_path,
+                    meshes[0].vertices[bake_output["vmapping"]],
+                    bake_output["indices"],
+                    vertex_normals=meshes[0].vertex_normals[bake_output["vmapping"]],
+                    uvs=bake_output["uvs"],
+                    texture=bake_output["colors"],
+                )
+            else:
+                import xatlas
 
-        timer.start("Exporting mesh and texture")
-        xatlas.export(out_mesh_path, meshes[0].vertices[bake_output["vmapping"]], bake_output["indices"], bake_output["uvs"], meshes[0].vertex_normals[bake_output["vmapping"]])
-        Image.fromarray((bake_output["colors"] * 255.0).astype(np.uint8)).transpose(Image.FLIP_TOP_BOTTOM).save(out_texture_path)
-        timer.end("Exporting mesh and texture")
-    else:
-        timer.start("Exporting mesh")
-        meshes[0].export(out_mesh_path)
-        timer.end("Exporting mesh")
+                xatlas.export(out_mesh_path, meshes[0].vertices[bake_output["vmapping"]], bake_output["indices"], bake_output["uvs"], meshes[0].vertex_normals[bake_output["vmapping"]])
+                Image.fromarray((bake_output["colors"] * 255.0).astype(np.uint8)).transpose(Image.FLIP_TOP_BOTTOM).save(out_texture_path)
+            timer.end("Exporting mesh and texture")
+        else:
+            timer.start("Exporting mesh")
+            export_mesh(
+                meshes[0].vertices,
+                meshes[0].faces,
+                {args.model_save_format: out_mesh_path},
+                vertex_colors=meshes[0].vertex_colors,
+            )
+            timer.end("Exporting mesh")
+
+
+# spawned worker processes (e.g. parallel atlas generation) import this module
+# as __mp_main__, they must not re-run the pipeline
+if __name__ == "__main__":
+    main()
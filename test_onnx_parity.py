@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Parity test for the onnxruntime backend: exports the image-to-triplane network
+and the decoder to ONNX and compares scene codes, decoder outputs, meshes and
+renders against the PyTorch path
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import torch
+from PIL import Image
+from tsr.system import TSR
+from tsr.utils import remove_background, resize_foreground
+from tsr.onnx_export import OnnxRuntimeBackend, export_onnx
+from test_precision_regression import chamfer_distance, psnr, run_pipeline
+import rembg
+
+MAX_SCENE_CODE_ERROR = 1e-3
+MAX_DECODER_ERROR = 1e-4
+MAX_CHAMFER_DISTANCE = 1e-3
+MIN_RENDER_PSNR = 40.0
+
+
+def test_onnx_parity():
+    """Compare the onnxruntime backend against PyTorch on an example image"""
+    print("🧪 Testing ONNX export and onnxruntime parity")
+    print("=" * 50)
+
+    device = "cpu"
+    print(f"🖥️  Using device: {device}")
+
+    print("📦 Loading TSR model...")
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+    )
+    model.renderer.set_chunk_size(8192)
+    model.to(device)
+    print("✅ Model loaded successfully")
+
+    test_image_path = "examples/chair.png"
+    if not os.path.exists(test_image_path):
+        print(f"❌ Test image not found: {test_image_path}")
+        return False
+
+    print("🎭 Preparing test image...")
+    rembg_session = rembg.new_session()
+    image = remove_background(Image.open(test_image_path), rembg_session)
+    image = resize_foreground(image, ratio=0.85)
+    image = np.array(image).astype(np.float32) / 255.0
+    image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+    image = Image.fromarray((image * 255.0).astype(np.uint8))
+
+    print("🧠 Running PyTorch reference...")
+    ref_codes, ref_mesh, ref_renders = run_pipeline(model, image, device)
+    features = torch.rand(65536, model.decoder.cfg.in_channels)
+    with torch.no_grad():
+        ref_decoder = model.decoder(features)
+
+    with tempfile.TemporaryDirectory() as onnx_dir:
+        print("📤 Exporting ONNX graphs...")
+        export_onnx(model, onnx_dir)
+        print("✅ Export completed")
+
+        print("🧠 Running onnxruntime...")
+        backend = OnnxRuntimeBackend(onnx_dir)
+        decoder = backend.decoder(features)
+        model.set_onnx_backend(backend)
+        codes, mesh, renders = run_pipeline(model, image, device)
+        # dynamic batch dimension
+        with torch.no_grad():
+            batch_codes = model([image, image], device=device)
+        # switching back restores the PyTorch path
+        model.set_onnx_backend(None)
+        restored_codes, _, _ = run_pipeline(model, image, device)
+        with torch.no_grad():
+            restored_decoder = model.decoder(features)
+
+    code_error = float((codes - ref_codes).abs().max() / ref_codes.abs().max())
+    batch_error = float((batch_codes - codes).abs().max() / ref_codes.abs().max())
+    decoder_error = max(
+        float((decoder[k] - ref_decoder[k]).abs().max()) for k in ref_decoder
+    )
+    restore_error = max(
+        float((restored_codes - ref_codes).abs().max()),
+        *(float((restored_decoder[k] - ref_decoder[k]).abs().max()) for k in ref_decoder),
+    )
+    chamfer = chamfer_distance(mesh.vertices, ref_mesh.vertices)
+    render_psnr = min(psnr(a, b) for a, b in zip(renders, ref_renders))
+
+    print(f"📊 Scene code max relative error: {code_error:.2e} (limit {MAX_SCENE_CODE_ERROR:.0e})")
+    print(f"📊 Batch of 2 max relative error: {batch_error:.2e}")
+    print(f"📊 Decoder max error: {decoder_error:.2e} (limit {MAX_DECODER_ERROR:.0e})")
+    print(f"📊 Max error after switching back to PyTorch: {restore_error:.2e}")
+    print(f"📊 Chamfer distance: {chamfer:.2e} (limit {MAX_CHAMFER_DISTANCE:.0e})")
+    print(f"📊 Worst render PSNR: {render_psnr:.1f} dB (limit {MIN_RENDER_PSNR:.0f} dB)")
+
+    success = True
+    if max(code_error, batch_error) > MAX_SCENE_CODE_ERROR:
+        print("❌ Scene codes deviate from PyTorch")
+        success = False
+    if decoder_error > MAX_DECODER_ERROR:
+        print("❌ Decoder outputs deviate from PyTorch")
+        success = False
+    if restore_error > 0:
+        print("❌ PyTorch path changed after using the ONNX backend")
+        success = False
+    if chamfer > MAX_CHAMFER_DISTANCE:
+        print("❌ Mesh deviates from PyTorch")
+        success = False
+    if render_psnr < MIN_RENDER_PSNR:
+        print("❌ Renders deviate from PyTorch")
+        success = False
+    return success
+
+
+if __name__ == "__main__":
+    success = test_onnx_parity()
+    if success:
+        print("\n🎉 ONNX parity test PASSED!")
+    else:
+        print("\n❌ ONNX parity test FAILED!")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test the multi-process UV atlas path: a mesh with several components is split
+over worker processes, and the packed atlas must cover every face without the
+single-process fallback
+"""
+
+import sys
+import numpy as np
+import trimesh
+import tsr.atlas as atlas_module
+from tsr.atlas import _parallel_atlas, _split_jobs, make_atlas
+
+N_JOBS = 4
+TEXTURE_RESOLUTION = 1024
+TEXTURE_PADDING = 4
+
+
+def make_mesh():
+    # separate spheres, as left by floaters around the main object
+    parts = []
+    for i in range(N_JOBS):
+        sphere = trimesh.creation.icosphere(subdivisions=2)
+        sphere.apply_translation([3.0 * i, 0.0, 0.0])
+        parts.append(sphere)
+    return trimesh.util.concatenate(parts)
+
+
+def test_parallel_atlas():
+    print("🧪 Testing parallel atlas generation")
+    print("=" * 50)
+
+    mesh = make_mesh()
+    vertices = np.ascontiguousarray(mesh.vertices, dtype=np.float32)
+    faces = np.ascontiguousarray(mesh.faces, dtype=np.uint32)
+    print(f"📐 Mesh: {len(faces)} faces")
+
+    jobs = _split_jobs(faces, len(vertices), N_JOBS)
+    print(f"🔀 Split into {len(jobs)} jobs")
+    packed = _parallel_atlas(
+        vertices,
+        faces,
+        jobs,
+        TEXTURE_RESOLUTION,
+        TEXTURE_PADDING,
+        atlas_module.ATLAS_PRESETS["balanced"],
+    )
+    if packed is None:
+        print("❌ Worker processes failed, the parallel path fell back")
+        return False
+    atlas, side = packed
+
+    success = True
+    uvs = atlas["uvs"]
+    if len(atlas["indices"]) != len(faces):
+        print(f"❌ Atlas has {len(atlas['indices'])} faces, mesh has {len(faces)}")
+        success = False
+    if uvs.min() < 0 or uvs.max() > 1:
+        print(f"❌ UVs outside [0, 1]: {uvs.min():.3f} .. {uvs.max():.3f}")
+        success = False
+    # every mesh vertex has at least one atlas vertex
+    if not np.array_equal(np.unique(atlas["vmapping"]), np.unique(faces)):
+        print("❌ Atlas vertices do not cover the mesh")
+        success = False
+    print(f"📊 Packed square: {side}px, gutter fraction {TEXTURE_PADDING / side:.5f}")
+
+    # make_atlas caches the gutter of the packed square, not of the target size
+    # a small mesh keeps the test fast, force the parallel path for it
+    atlas_module.PARALLEL_MIN_FACES = 0
+    atlas_module.os.cpu_count = lambda: N_JOBS
+    atlas_module._atlas_cache.clear()
+    make_atlas(mesh, TEXTURE_RESOLUTION, TEXTURE_PADDING)
+    (cached,) = atlas_module._atlas_cache.values()
+    print(f"📊 Cached gutter fraction: {cached['padding_fraction']:.5f}")
+    if abs(cached["padding_fraction"] - TEXTURE_PADDING / side) > 1e-9:
+        print("❌ Cached gutter fraction does not match the packed atlas")
+        success = False
+    return success
+
+
+# spawned workers import this script as __mp_main__
+if __name__ == "__main__":
+    success = test_parallel_atlas()
+    if success:
+        print("\n🎉 Parallel atlas test PASSED!")
+    else:
+        print("\n❌ Parallel atlas test FAILED!")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Regression check for low-precision inference: compares scene codes, meshes and
+renders produced with --precision bf16/fp16 against the fp32 reference
+"""
+
+import os
+import sys
+import numpy as np
+import torch
+from PIL import Image
+from tsr.system import TSR
+from tsr.utils import remove_background, resize_foreground
+import rembg
+
+# guardrails, meshes live in a [-0.87, 0.87] cube
+MAX_CHAMFER_DISTANCE = 5e-3
+MIN_RENDER_PSNR = 30.0
+MC_RESOLUTION = 256
+N_VIEWS = 4
+
+
+def chamfer_distance(points_a, points_b, n_samples=20000, chunk_size=4096):
+    """Symmetric mean nearest-neighbour distance between two vertex sets"""
+    rng = np.random.default_rng(0)
+    a = torch.from_numpy(points_a[rng.choice(len(points_a), min(n_samples, len(points_a)), replace=False)])
+    b = torch.from_numpy(points_b[rng.choice(len(points_b), min(n_samples, len(points_b)), replace=False)])
+
+    def one_way(x, y):
+        return torch.cat([torch.cdist(x[i:i + chunk_size], y).min(dim=1).values for i in range(0, len(x), chunk_size)]).mean()
+
+    return float(one_way(a, b) + one_way(b, a)) / 2
+
+
+def psnr(image_a, image_b):
+    mse = np.mean((np.asarray(image_a, dtype=np.float32) / 255.0 - np.asarray(image_b, dtype=np.float32) / 255.0) ** 2)
+    return float("inf") if mse == 0 else float(-10 * np.log10(mse))
+
+
+def run_pipeline(model, image, device):
+    with torch.no_grad():
+        scene_codes = model([image], device=device)
+    mesh = model.extract_mesh(scene_codes, has_vertex_color=False, resolution=MC_RESOLUTION)[0]
+    renders = model.render(scene_codes, n_views=N_VIEWS, return_type="pil")[0]
+    return scene_codes, mesh, renders
+
+
+def test_precision_regression(precision="bf16"):
+    """Compare a reduced precision run against fp32 on an example image"""
+    print(f"🧪 Testing {precision} inference against fp32")
+    print("=" * 50)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"🖥️  Using device: {device}")
+
+    print("📦 Loading TSR model...")
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+    )
+    model.renderer.set_chunk_size(8192)
+    model.to(device)
+    print("✅ Model loaded successfully")
+
+    test_image_path = "examples/chair.png"
+    if not os.path.exists(test_image_path):
+        print(f"❌ Test image not found: {test_image_path}")
+        return False
+
+    print("🎭 Preparing test image...")
+    rembg_session = rembg.new_session()
+    image = remove_background(Image.open(test_image_path), rembg_session)
+    image = resize_foreground(image, ratio=0.85)
+    image = np.array(image).astype(np.float32) / 255.0
+    image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+    image = Image.fromarray((image * 255.0).astype(np.uint8))
+
+    print("🧠 Running fp32 reference...")
+    model.set_precision("fp32")
+    ref_codes, ref_mesh, ref_renders = run_pipeline(model, image, device)
+
+    print(f"🧠 Running {precision}...")
+    model.set_precision(precision)
+    codes, mesh, renders = run_pipeline(model, image, device)
+    model.set_precision("fp32")
+
+    code_error = float((codes - ref_codes).abs().max() / ref_codes.abs().max())
+    chamfer = chamfer_distance(mesh.vertices, ref_mesh.vertices)
+    render_psnr = min(psnr(a, b) for a, b in zip(renders, ref_renders))
+
+    print(f"📊 Scene code max relative error: {code_error:.2e}")
+    print(f"📊 Mesh: {len(mesh.faces)} faces vs {len(ref_mesh.faces)} fp32 faces")
+    print(f"📊 Chamfer distance: {chamfer:.2e} (limit {MAX_CHAMFER_DISTANCE:.0e})")
+    print(f"📊 Worst render PSNR: {render_psnr:.1f} dB (limit {MIN_RENDER_PSNR:.0f} dB)")
+
+    success = True
+    if chamfer > MAX_CHAMFER_DISTANCE:
+        print("❌ Mesh deviates too far from fp32")
+        success = False
+    if render_psnr < MIN_RENDER_PSNR:
+        print("❌ Renders deviate too far from fp32")
+        success = False
+    return success
+
+
+if __name__ == "__main__":
+    precision = sys.argv[1] if len(sys.argv) > 1 else "bf16"
+    success = test_precision_regression(precision)
+    if success:
+        print(f"\n🎉 {precision} precision regression test PASSED!")
+    else:
+        print(f"\n❌ {precision} precision regression test FAILED!")
+        print("🔧 Keep this precision disabled on this hardware")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test that a model loaded with TSR.from_pretrained is in inference mode and
+reuses the cached backbone prefix across get_scene_codes calls
+"""
+
+import sys
+import torch
+from PIL import Image
+from tsr.system import TSR
+
+
+def test_prefix_cache():
+    print("🧪 Testing the backbone prefix cache")
+    print("=" * 50)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"🖥️  Using device: {device}")
+
+    print("📦 Loading TSR model...")
+    model = TSR.from_pretrained(
+        "stabilityai/TripoSR",
+        config_name="config.yaml",
+        weight_name="model.ckpt",
+        device=device,
+    )
+    print("✅ Model loaded successfully")
+
+    if model.training:
+        print("❌ from_pretrained returned a model in training mode")
+        return False
+
+    # count prefix computations, cache hits skip forward_prefix
+    calls = []
+    forward_prefix = model.backbone.forward_prefix
+
+    def counting_forward_prefix(hidden_states):
+        calls.append(hidden_states.shape)
+        return forward_prefix(hidden_states)
+
+    model.backbone.forward_prefix = counting_forward_prefix
+
+    image = Image.new("RGB", (512, 512), (127, 127, 127))
+    with torch.no_grad():
+        first = model([image], device=device)
+        cache_size = len(model.backbone._prefix_cache)
+        second = model([image], device=device)
+
+    print(f"📊 Prefix computations: {len(calls)}, cache entries: {cache_size}")
+    success = True
+    if cache_size != 1:
+        print("❌ The first call did not fill the prefix cache")
+        success = False
+    if len(calls) != 1:
+        print("❌ The second call did not hit the prefix cache")
+        success = False
+    if not torch.equal(first, second):
+        print("❌ Cached and uncached scene codes differ")
+        success = False
+    return success
+
+
+if __name__ == "__main__":
+    success = test_prefix_cache()
+    if success:
+        print("\n🎉 Prefix cache test PASSED!")
+    else:
+        print("\n❌ Prefix cache test FAILED!")
+    sys.exit(0 if success else 1)
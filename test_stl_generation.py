@@ -11,6 +11,7 @@ import trimesh
 import tempfile
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground
+from tsr.mesh_export import export_mesh
 import rembg
 
 def test_stl_generation():
@@ -90,22 +91,15 @@ def test_stl_generation():
         print("🏗️  Extracting 3D mesh...")
         meshes = model.extract_mesh(scene_codes, has_vertex_color=False)
         
-        # Export OBJ
+        # Export OBJ and STL straight from the extracted arrays
+        print("🔄 Writing OBJ and STL files...")
         obj_path = os.path.join(temp_dir, "mesh.obj")
-        meshes[0].export(obj_path)
-        print("📦 OBJ file exported")
-        
-        # Test STL conversion with trimesh
-        print("🔄 Converting to STL format...")
         stl_path = os.path.join(temp_dir, "mesh.stl")
         
         try:
-            # Load OBJ with trimesh
-            mesh_trimesh = trimesh.load(obj_path)
-            print(f"📊 Mesh info: {len(mesh_trimesh.vertices)} vertices, {len(mesh_trimesh.faces)} faces")
-            
-            # Export as STL
-            mesh_trimesh.export(stl_path)
+            export_mesh(meshes[0].vertices, meshes[0].faces, {"obj": obj_path, "stl": stl_path})
+            print("📦 OBJ file exported")
+            print(f"📊 Mesh info: {len(meshes[0].vertices)} vertices, {len(meshes[0].faces)} faces")
             
             # Verify STL file
             if os.path.exists(stl_path) and os.path.getsize(stl_path) > 0:
@@ -0,0 +1,229 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# xatlas ChartOptions / PackOptions overrides, "balanced" keeps the defaults
+ATLAS_PRESETS: Dict[str, Dict[str, Dict]] = {
+    "quality": {
+        "chart": {"max_iterations": 4},
+        "pack": {"bruteForce": True},
+    },
+    "balanced": {
+        "chart": {},
+        "pack": {},
+    },
+    "fast": {
+        "chart": {"max_iterations": 1, "max_cost": 4.0},
+        "pack": {"blockAlign": True, "rotate_charts": False},
+    },
+}
+
+ATLAS_CACHE_SIZE = 8
+# below this face count the process pool costs more than it saves
+PARALLEL_MIN_FACES = 20000
+
+_atlas_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_atlas_cache_lock = threading.Lock()
+
+
+def _options(cls, overrides):
+    options = cls()
+    for k, v in overrides.items():
+        setattr(options, k, v)
+    return options
+
+
+def _generate(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    chart_options: Dict,
+    pack_options: Dict,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]:
+    import xatlas
+
+    atlas = xatlas.Atlas()
+    atlas.add_mesh(vertices, faces)
+    atlas.generate(
+        _options(xatlas.ChartOptions, chart_options),
+        _options(xatlas.PackOptions, pack_options),
+    )
+    vmapping, indices, uvs = atlas[0]
+    return vmapping, indices, uvs, atlas.width, atlas.height
+
+
+def connected_components(faces: np.ndarray, n_vertices: int) -> np.ndarray:
+    # per-vertex component labels by min-label propagation with pointer jumping
+    labels = np.arange(n_vertices)
+    flat = faces.reshape(-1)
+    while True:
+        face_min = labels[faces].min(axis=1)
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, flat, np.repeat(face_min, 3))
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def _split_jobs(faces: np.ndarray, n_vertices: int, n_jobs: int) -> List[np.ndarray]:
+    # greedily spread connected components over n_jobs face sets, largest first
+    component = connected_components(faces, n_vertices)[faces[:, 0]]
+    ids, component, counts = np.unique(component, return_inverse=True, return_counts=True)
+    if len(ids) < 2:
+        return [np.arange(len(faces))]
+    order = np.argsort(component, kind="stable")
+    groups = np.split(order, np.cumsum(counts)[:-1])
+    loads = [0] * min(n_jobs, len(groups))
+    jobs: List[List[np.ndarray]] = [[] for _ in loads]
+    for c in np.argsort(-counts, kind="stable"):
+        j = int(np.argmin(loads))
+        jobs[j].append(groups[c])
+        loads[j] += int(counts[c])
+    return [np.sort(np.concatenate(job)) for job in jobs]
+
+
+def _shelf_pack(sizes: List[Tuple[int, int]], padding: int) -> Tuple[np.ndarray, int]:
+    # place rectangles row by row into a square of side close to sqrt(total area)
+    padded = [(w + padding, h + padding) for w, h in sizes]
+    side = max(
+        max(w for w, _ in padded),
+        int(math.ceil(math.sqrt(sum(w * h for w, h in padded)))),
+    )
+    offsets = np.zeros((len(sizes), 2), dtype=np.float32)
+    x = y = row_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -padded[i][1]):
+        w, h = padded[i]
+        if x + w > side:
+            x, y, row_height = 0, y + row_height, 0
+        offsets[i] = (x, y)
+        x += w
+        row_height = max(row_height, h)
+    return offsets, max(side, y + row_height)
+
+
+def _parallel_atlas(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    jobs: List[np.ndarray],
+    texture_resolution: int,
+    texture_padding: int,
+    preset: Dict,
+) -> Optional[Tuple[Dict[str, np.ndarray], int]]:
+    # (atlas, side of the packed square in texels), None when the worker
+    # processes cannot be started or die
+    # a shared texel density keeps the per-job atlases at the same scale
+    tris = vertices[faces]
+    area = 0.5 * np.linalg.norm(
+        np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0]), axis=1
+    ).sum()
+    pack_options = dict(
+        preset["pack"],
+        padding=texture_padding,
+        bilinear=True,
+        resolution=0,
+        texels_per_unit=float(texture_resolution * math.sqrt(0.5 / max(area, 1e-12))),
+    )
+
+    job_meshes = []
+    for job_faces in jobs:
+        used, local_faces = np.unique(faces[job_faces], return_inverse=True)
+        job_meshes.append((used, local_faces.reshape(-1, 3).astype(np.uint32)))
+
+    # spawned workers, forking a threaded (CUDA) server process is unsafe
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(len(jobs), os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            results = list(
+                executor.map(
+                    _generate,
+                    [vertices[used] for used, _ in job_meshes],
+                    [local_faces for _, local_faces in job_meshes],
+                    [preset["chart"]] * len(jobs),
+                    [pack_options] * len(jobs),
+                )
+            )
+    except (BrokenProcessPool, OSError) as e:
+        print(f"Parallel atlas generation failed, using a single process: {e}")
+        return None
+
+    offsets, side = _shelf_pack([(r[3], r[4]) for r in results], texture_padding)
+    vmapping, indices, uvs = [], [], []
+    n_atlas_vertices = 0
+    for (used, _), offset, (vm, idx, uv, width, height) in zip(
+        job_meshes, offsets, results
+    ):
+        vmapping.append(used[vm])
+        indices.append(idx + n_atlas_vertices)
+        uvs.append((uv * np.array([width, height]) + offset) / side)
+        n_atlas_vertices += len(vm)
+    atlas = {
+        "vmapping": np.concatenate(vmapping).astype(np.uint32),
+        "indices": np.concatenate(indices).astype(np.uint32),
+        "uvs": np.concatenate(uvs).astype(np.float32),
+    }
+    return atlas, side
+
+
+def make_atlas(mesh, texture_resolution, texture_padding, preset="balanced"):
+    """
+    UV atlas for the mesh, cached by mesh content and preset. A cached atlas is
+    reused at any resolution whose gutter (padding / resolution) it already covers.
+    """
+    if preset not in ATLAS_PRESETS:
+        raise ValueError(
+            f"Unknown atlas preset: {preset}, expected one of {list(ATLAS_PRESETS)}"
+        )
+    vertices = np.ascontiguousarray(mesh.vertices, dtype=np.float32)
+    faces = np.ascontiguousarray(mesh.faces, dtype=np.uint32)
+    key = hashlib.sha1(
+        vertices.tobytes() + faces.tobytes() + preset.encode()
+    ).hexdigest()
+    padding_fraction = texture_padding / texture_resolution
+
+    with _atlas_cache_lock:
+        cached = _atlas_cache.get(key)
+        if cached is not None and cached["padding_fraction"] >= padding_fraction:
+            _atlas_cache.move_to_end(key)
+            return cached["atlas"]
+
+    n_jobs = os.cpu_count() or 1
+    jobs = None
+    if n_jobs > 1 and len(faces) >= PARALLEL_MIN_FACES:
+        jobs = _split_jobs(faces, len(vertices), n_jobs)
+    atlas = None
+    if jobs is not None and len(jobs) > 1:
+        packed = _parallel_atlas(
+            vertices, faces, jobs, texture_resolution, texture_padding, ATLAS_PRESETS[preset]
+        )
+        if packed is not None:
+            atlas, side = packed
+            # the gutters are texture_padding texels of the packed square
+            padding_fraction = texture_padding / side
+    if atlas is None:
+        pack_options = dict(
+            ATLAS_PRESETS[preset]["pack"],
+            resolution=texture_resolution,
+            padding=texture_padding,
+            bilinear=True,
+        )
+        vmapping, indices, uvs, _, _ = _generate(
+            vertices, faces, ATLAS_PRESETS[preset]["chart"], pack_options
+        )
+        atlas = {"vmapping": vmapping, "indices": indices, "uvs": uvs}
+
+    with _atlas_cache_lock:
+        _atlas_cache[key] = {"atlas": atlas, "padding_fraction": padding_fraction}
+        _atlas_cache.move_to_end(key)
+        while len(_atlas_cache) > ATLAS_CACHE_SIZE:
+            _atlas_cache.popitem(last=False)
+    return atlas
@@ -1,156 +1,227 @@
+import threading
+
 import numpy as np
 import torch
-import xatlas
-import trimesh
-import moderngl
 from PIL import Image
 
+from .atlas import make_atlas
+from .soft_rasterizer import rasterize_position_atlas_torch
 
-def make_atlas(mesh, texture_resolution, texture_padding):
-    atlas = xatlas.Atlas()
-    atlas.add_mesh(mesh.vertices, mesh.faces)
-    options = xatlas.PackOptions()
-    options.resolution = texture_resolution
-    options.padding = texture_padding
-    options.bilinear = True
-    atlas.generate(pack_options=options)
-    vmapping, indices, uvs = atlas[0]
-    return {
-        "vmapping": vmapping,
-        "indices": indices,
-        "uvs": uvs,
-    }
+
+class PositionAtlasRasterizer:
+    """
+    Owns a single OpenGL context with the atlas shader programs compiled once
+    and one framebuffer per texture resolution. Per-bake buffers are released
+    after every draw, so repeated bakes only pay for the draw calls.
+    """
+
+    def __init__(self) -> None:
+        import moderngl
+
+        try:
+            self.ctx = moderngl.create_context(standalone=True)
+        except Exception:
+            # headless machines without an X display
+            self.ctx = moderngl.create_context(standalone=True, backend="egl")
+        self.basic_prog = self.ctx.program(
+            vertex_shader="""
+                #version 330
+                in vec2 in_uv;
+                in vec3 in_pos;
+                out vec3 v_pos;
+                void main() {
+                    v_pos = in_pos;
+                    gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
+                }
+            """,
+            fragment_shader="""
+                #version 330
+                in vec3 v_pos;
+                out vec4 o_col;
+                void main() {
+                    o_col = vec4(v_pos, 1.0);
+                }
+            """,
+        )
+        self.gs_prog = self.ctx.program(
+            vertex_shader="""
+                #version 330
+                in vec2 in_uv;
+                in vec3 in_pos;
+                out vec3 vg_pos;
+                void main() {
+                    vg_pos = in_pos;
+                    gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
+                }
+            """,
+            geometry_shader="""
+                #version 330
+                uniform float u_resolution;
+                uniform float u_dilation;
+                layout (triangles) in;
+                layout (triangle_strip, max_vertices = 12) out;
+                in vec3 vg_pos[];
+                out vec3 vf_pos;
+                void lineSegment(int aidx, int bidx) {
+                    vec2 a = gl_in[aidx].gl_Position.xy;
+                    vec2 b = gl_in[bidx].gl_Position.xy;
+                    vec3 aCol = vg_pos[aidx];
+                    vec3 bCol = vg_pos[bidx];
+
+                    vec2 dir = normalize((b - a) * u_resolution);
+                    vec2 offset = vec2(-dir.y, dir.x) * u_dilation / u_resolution;
+
+                    gl_Position = vec4(a + offset, 0.0, 1.0);
+                    vf_pos = aCol;
+                    EmitVertex();
+                    gl_Position = vec4(a - offset, 0.0, 1.0);
+                    vf_pos = aCol;
+                    EmitVertex();
+                    gl_Position = vec4(b + offset, 0.0, 1.0);
+                    vf_pos = bCol;
+                    EmitVertex();
+                    gl_Position = vec4(b - offset, 0.0, 1.0);
+                    vf_pos = bCol;
+                    EmitVertex();
+                }
+                void main() {
+                    lineSegment(0, 1);
+                    lineSegment(1, 2);
+                    lineSegment(2, 0);
+                    EndPrimitive();
+                }
+            """,
+            fragment_shader="""
+                #version 330
+                in vec3 vf_pos;
+                out vec4 o_col;
+                void main() {
+                    o_col = vec4(vf_pos, 1.0);
+                }
+            """,
+        )
+        self._fbos = {}
+        self._lock = threading.Lock()
+
+    def _framebuffer(self, texture_resolution):
+        fbo = self._fbos.get(texture_resolution)
+        if fbo is None:
+            fbo = self.ctx.framebuffer(
+                color_attachments=[
+                    self.ctx.texture(
+                        (texture_resolution, texture_resolution), 4, dtype="f4"
+                    )
+                ]
+            )
+            self._fbos[texture_resolution] = fbo
+        return fbo
+
+    def rasterize(self, positions, uvs, indices, texture_resolution, texture_padding):
+        # the context is made current on whichever thread bakes
+        with self._lock, self.ctx:
+            vbo_uvs = self.ctx.buffer(uvs.flatten().astype("f4"))
+            vbo_pos = self.ctx.buffer(positions.flatten().astype("f4"))
+            ibo = self.ctx.buffer(indices.flatten().astype("i4"))
+            vao_content = [
+                vbo_uvs.bind("in_uv", layout="2f"),
+                vbo_pos.bind("in_pos", layout="3f"),
+            ]
+            basic_vao = self.ctx.vertex_array(self.basic_prog, vao_content, ibo)
+            gs_vao = self.ctx.vertex_array(self.gs_prog, vao_content, ibo)
+            try:
+                fbo = self._framebuffer(texture_resolution)
+                fbo.use()
+                fbo.clear(0.0, 0.0, 0.0, 0.0)
+                self.gs_prog["u_resolution"].value = texture_resolution
+                self.gs_prog["u_dilation"].value = texture_padding
+                gs_vao.render()
+                basic_vao.render()
+                fbo_bytes = fbo.color_attachments[0].read()
+            finally:
+                for obj in (basic_vao, gs_vao, vbo_uvs, vbo_pos, ibo):
+                    obj.release()
+        return np.frombuffer(fbo_bytes, dtype="f4").reshape(
+            texture_resolution, texture_resolution, 4
+        )
+
+    def release(self):
+        with self._lock:
+            with self.ctx:
+                for fbo in self._fbos.values():
+                    for attachment in fbo.color_attachments:
+                        attachment.release()
+                    fbo.release()
+                self._fbos.clear()
+                self.basic_prog.release()
+                self.gs_prog.release()
+            self.ctx.release()
+
+
+_rasterizer = None
+_rasterizer_failed = False
+_rasterizer_lock = threading.Lock()
+
+
+def get_rasterizer():
+    # None when no OpenGL 3.3 context can be created on this machine
+    global _rasterizer, _rasterizer_failed
+    with _rasterizer_lock:
+        if _rasterizer is None and not _rasterizer_failed:
+            try:
+                _rasterizer = PositionAtlasRasterizer()
+            except Exception as e:
+                print(f"OpenGL rasterizer unavailable ({e}), using software rasterizer")
+                _rasterizer_failed = True
+    return _rasterizer
 
 
 def rasterize_position_atlas(
-    mesh, atlas_vmapping, atlas_indices, atlas_uvs, texture_resolution, texture_padding
+    mesh,
+    atlas_vmapping,
+    atlas_indices,
+    atlas_uvs,
+    texture_resolution,
+    texture_padding,
+    device=None,
 ):
-    ctx = moderngl.create_context(standalone=True)
-    basic_prog = ctx.program(
-        vertex_shader="""
-            #version 330
-            in vec2 in_uv;
-            in vec3 in_pos;
-            out vec3 v_pos;
-            void main() {
-                v_pos = in_pos;
-                gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
-            }
-        """,
-        fragment_shader="""
-            #version 330
-            in vec3 v_pos;
-            out vec4 o_col;
-            void main() {
-                o_col = vec4(v_pos, 1.0);
-            }
-        """,
-    )
-    gs_prog = ctx.program(
-        vertex_shader="""
-            #version 330
-            in vec2 in_uv;
-            in vec3 in_pos;
-            out vec3 vg_pos;
-            void main() {
-                vg_pos = in_pos;
-                gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
-            }
-        """,
-        geometry_shader="""
-            #version 330
-            uniform float u_resolution;
-            uniform float u_dilation;
-            layout (triangles) in;
-            layout (triangle_strip, max_vertices = 12) out;
-            in vec3 vg_pos[];
-            out vec3 vf_pos;
-            void lineSegment(int aidx, int bidx) {
-                vec2 a = gl_in[aidx].gl_Position.xy;
-                vec2 b = gl_in[bidx].gl_Position.xy;
-                vec3 aCol = vg_pos[aidx];
-                vec3 bCol = vg_pos[bidx];
-
-                vec2 dir = normalize((b - a) * u_resolution);
-                vec2 offset = vec2(-dir.y, dir.x) * u_dilation / u_resolution;
-
-                gl_Position = vec4(a + offset, 0.0, 1.0);
-                vf_pos = aCol;
-                EmitVertex();
-                gl_Position = vec4(a - offset, 0.0, 1.0);
-                vf_pos = aCol;
-                EmitVertex();
-                gl_Position = vec4(b + offset, 0.0, 1.0);
-                vf_pos = bCol;
-                EmitVertex();
-                gl_Position = vec4(b - offset, 0.0, 1.0);
-                vf_pos = bCol;
-                EmitVertex();
-            }
-            void main() {
-                lineSegment(0, 1);
-                lineSegment(1, 2);
-                lineSegment(2, 0);
-                EndPrimitive();
-            }
-        """,
-        fragment_shader="""
-            #version 330
-            in vec3 vf_pos;
-            out vec4 o_col;
-            void main() {
-                o_col = vec4(vf_pos, 1.0);
-            }
-        """,
-    )
-    uvs = atlas_uvs.flatten().astype("f4")
-    pos = mesh.vertices[atlas_vmapping].flatten().astype("f4")
-    indices = atlas_indices.flatten().astype("i4")
-    vbo_uvs = ctx.buffer(uvs)
-    vbo_pos = ctx.buffer(pos)
-    ibo = ctx.buffer(indices)
-    vao_content = [
-        vbo_uvs.bind("in_uv", layout="2f"),
-        vbo_pos.bind("in_pos", layout="3f"),
-    ]
-    basic_vao = ctx.vertex_array(basic_prog, vao_content, ibo)
-    gs_vao = ctx.vertex_array(gs_prog, vao_content, ibo)
-    fbo = ctx.framebuffer(
-        color_attachments=[
-            ctx.texture((texture_resolution, texture_resolution), 4, dtype="f4")
-        ]
-    )
-    fbo.use()
-    fbo.clear(0.0, 0.0, 0.0, 0.0)
-    gs_prog["u_resolution"].value = texture_resolution
-    gs_prog["u_dilation"].value = texture_padding
-    gs_vao.render()
-    basic_vao.render()
-
-    fbo_bytes = fbo.color_attachments[0].read()
-    fbo_np = np.frombuffer(fbo_bytes, dtype="f4").reshape(
-        texture_resolution, texture_resolution, 4
+    positions = mesh.vertices[atlas_vmapping]
+    rasterizer = get_rasterizer()
+    if rasterizer is None:
+        return rasterize_position_atlas_torch(
+            positions,
+            atlas_uvs,
+            atlas_indices,
+            texture_resolution,
+            texture_padding,
+            device=device,
+        )
+    return rasterizer.rasterize(
+        positions,
+        atlas_uvs,
+        atlas_indices,
+        texture_resolution,
+        texture_padding,
     )
-    return fbo_np
 
 
 def positions_to_colors(model, scene_code, positions_texture, texture_resolution):
-    positions = torch.tensor(positions_texture.reshape(-1, 4)[:, :-1])
+    positions_texture = positions_texture.reshape(-1, 4)
+    # only texels covered by the atlas hold a surface position, skip the rest
+    mask = positions_texture[:, -1] != 0.0
+    positions = torch.from_numpy(np.ascontiguousarray(positions_texture[mask, :3]))
     with torch.no_grad():
-        queried_grid = model.renderer.query_triplane(
-            model.decoder,
-            positions,
-            scene_code,
-        )
-    rgb_f = queried_grid["color"].numpy().reshape(-1, 3)
-    rgba_f = np.insert(rgb_f, 3, positions_texture.reshape(-1, 4)[:, -1], axis=1)
-    rgba_f[rgba_f[:, -1] == 0.0] = [0, 0, 0, 0]
+        colors = model.renderer.query_triplane(
+            model.active_decoder, positions, scene_code, output_device="cpu"
+        )["color"]
+    rgba_f = np.zeros((positions_texture.shape[0], 4), dtype=np.float32)
+    rgba_f[mask, :3] = colors.cpu().numpy()
+    rgba_f[mask, 3] = positions_texture[mask, 3]
     return rgba_f.reshape(texture_resolution, texture_resolution, 4)
 
 
-def bake_texture(mesh, model, scene_code, texture_resolution):
+def bake_texture(mesh, model, scene_code, texture_resolution, atlas_preset="balanced"):
     texture_padding = round(max(2, texture_resolution / 256))
-    atlas = make_atlas(mesh, texture_resolution, texture_padding)
+    atlas = make_atlas(mesh, texture_resolution, texture_padding, preset=atlas_preset)
     positions_texture = rasterize_position_atlas(
         mesh,
         atlas["vmapping"],
@@ -158,6 +229,7 @@ def bake_texture(mesh, model, scene_code, texture_resolution):
         atlas["uvs"],
         texture_resolution,
         texture_padding,
+        device=scene_code.device,
     )
     colors_texture = positions_to_colors(
         model, scene_code, positions_texture, texture_resolution
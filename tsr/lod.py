@@ -0,0 +1,127 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .mesh import Mesh
+
+DEFAULT_LOD_FACE_COUNTS = (5000, 50000)
+
+
+def _cluster_ids(vertices: np.ndarray, grid_resolution: int) -> np.ndarray:
+    # snap vertices to a uniform grid over the bounding box
+    bbox_min = vertices.min(axis=0)
+    extent = max(float((vertices.max(axis=0) - bbox_min).max()), 1e-8)
+    cell = extent / grid_resolution
+    cell_idx = np.floor((vertices - bbox_min) / cell).astype(np.int64)
+    cell_idx = np.clip(cell_idx, 0, grid_resolution - 1)
+    keys = (
+        cell_idx[:, 0] * (grid_resolution * grid_resolution)
+        + cell_idx[:, 1] * grid_resolution
+        + cell_idx[:, 2]
+    )
+    _, cluster = np.unique(keys, return_inverse=True)
+    return cluster.reshape(-1)
+
+
+def _non_degenerate(faces: np.ndarray) -> np.ndarray:
+    return (
+        (faces[:, 0] != faces[:, 1])
+        & (faces[:, 1] != faces[:, 2])
+        & (faces[:, 2] != faces[:, 0])
+    )
+
+
+def cluster_vertices(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    grid_resolution: int,
+    vertex_colors: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    # merge every grid cluster into its centroid and drop the collapsed faces
+    cluster = _cluster_ids(vertices, grid_resolution)
+    n_clusters = int(cluster.max()) + 1
+    counts = np.bincount(cluster, minlength=n_clusters)[:, None]
+
+    new_vertices = (
+        np.stack(
+            [np.bincount(cluster, vertices[:, i], n_clusters) for i in range(3)],
+            axis=-1,
+        )
+        / counts
+    )
+
+    new_colors = None
+    if vertex_colors is not None:
+        new_colors = (
+            np.stack(
+                [
+                    np.bincount(cluster, vertex_colors[:, i], n_clusters)
+                    for i in range(vertex_colors.shape[1])
+                ],
+                axis=-1,
+            )
+            / counts
+        )
+
+    new_faces = cluster[faces]
+    new_faces = new_faces[_non_degenerate(new_faces)]
+    # remove faces that collapsed onto the same three clusters
+    _, unique_idx = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(unique_idx)]
+
+    # drop clusters no longer referenced by any face
+    used, new_faces = np.unique(new_faces, return_inverse=True)
+    new_faces = new_faces.reshape(-1, 3)
+    new_vertices = new_vertices[used].astype(vertices.dtype)
+    if new_colors is not None:
+        new_colors = new_colors[used]
+        if np.issubdtype(vertex_colors.dtype, np.integer):
+            new_colors = new_colors.round()
+        new_colors = new_colors.astype(vertex_colors.dtype)
+    return new_vertices, new_faces, new_colors
+
+
+def decimate(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    target_face_count: int,
+    vertex_colors: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    if faces.shape[0] <= target_face_count:
+        return vertices, faces, vertex_colors
+
+    # face count grows roughly quadratically with the grid resolution, so
+    # bisect for the finest grid that still fits the budget; counting the
+    # non-degenerate faces is enough to steer the search
+    lo, hi = 2, 1024
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        n_faces = int(_non_degenerate(_cluster_ids(vertices, mid)[faces]).sum())
+        if n_faces <= target_face_count:
+            lo = mid
+        else:
+            hi = mid - 1
+    return cluster_vertices(vertices, faces, lo, vertex_colors)
+
+
+def build_lod_chain(
+    mesh: Mesh,
+    face_counts: Sequence[int] = DEFAULT_LOD_FACE_COUNTS,
+) -> List[Mesh]:
+    """
+    Build a level-of-detail chain ordered from the coarsest level to the full mesh.
+    Levels whose face budget is not below the full mesh are skipped.
+    """
+    vertices, faces = mesh.vertices, mesh.faces
+    vertex_colors = mesh.vertex_colors
+    if vertex_colors is not None:
+        vertex_colors = np.asarray(vertex_colors)
+
+    chain = []
+    for face_count in sorted(set(face_counts)):
+        if face_count >= faces.shape[0]:
+            break
+        v, f, c = decimate(vertices, faces, face_count, vertex_colors)
+        chain.append(Mesh(v, f, vertex_colors=c))
+    chain.append(mesh)
+    return chain
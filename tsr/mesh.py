@@ -0,0 +1,89 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from .mesh_export import MESH_WRITERS
+
+
+class Mesh:
+    """
+    Triangle mesh as produced by marching cubes: float32 vertices shared
+    between neighbouring faces and int32 face indices, without the cleanup
+    pass that trimesh runs on construction.
+    """
+
+    def __init__(
+        self,
+        vertices: np.ndarray,
+        faces: np.ndarray,
+        vertex_colors: Optional[np.ndarray] = None,
+        vertex_normals: Optional[np.ndarray] = None,
+    ) -> None:
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32)
+        self.vertex_colors = vertex_colors
+        self._vertex_normals = vertex_normals
+
+    def __repr__(self) -> str:
+        return f"<tsr.Mesh(vertices.shape={self.vertices.shape}, faces.shape={self.faces.shape})>"
+
+    @property
+    def vertex_normals(self) -> np.ndarray:
+        if self._vertex_normals is None:
+            # area-weighted average of the adjacent face normals
+            tris = self.vertices[self.faces]
+            face_normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+            normals = np.zeros_like(self.vertices)
+            for i in range(3):
+                np.add.at(normals, self.faces[:, i], face_normals)
+            norm = np.linalg.norm(normals, axis=1, keepdims=True)
+            self._vertex_normals = normals / np.maximum(norm, 1e-12)
+        return self._vertex_normals
+
+    @vertex_normals.setter
+    def vertex_normals(self, vertex_normals: Optional[np.ndarray]) -> None:
+        self._vertex_normals = vertex_normals
+
+    def apply_transform(self, matrix: np.ndarray) -> "Mesh":
+        matrix = np.asarray(matrix, dtype=np.float64)
+        self.vertices = (
+            self.vertices.astype(np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+        ).astype(np.float32)
+        if self._vertex_normals is not None:
+            normals = self._vertex_normals @ np.linalg.inv(matrix[:3, :3])
+            norm = np.linalg.norm(normals, axis=1, keepdims=True)
+            self._vertex_normals = (normals / np.maximum(norm, 1e-12)).astype(
+                np.float32
+            )
+        return self
+
+    def export(self, path: str, file_type: Optional[str] = None) -> None:
+        file_type = (file_type or os.path.splitext(path)[1][1:]).lower()
+        if file_type not in MESH_WRITERS:
+            raise ValueError(
+                f"Unsupported mesh format: {file_type}, expected one of {list(MESH_WRITERS)}"
+            )
+        if file_type == "stl":
+            MESH_WRITERS[file_type](path, self.vertices, self.faces)
+        elif file_type == "glb":
+            MESH_WRITERS[file_type](
+                path,
+                self.vertices,
+                self.faces,
+                self.vertex_colors,
+                vertex_normals=self._vertex_normals,
+            )
+        else:
+            MESH_WRITERS[file_type](path, self.vertices, self.faces, self.vertex_colors)
+
+    def to_trimesh(self):
+        import trimesh
+
+        return trimesh.Trimesh(
+            vertices=self.vertices,
+            faces=self.faces,
+            vertex_colors=self.vertex_colors,
+            vertex_normals=self._vertex_normals,
+            process=False,
+        )
@@ -0,0 +1,433 @@
+import io
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def _as_rgba8(vertex_colors: np.ndarray) -> np.ndarray:
+    # accept float colors in [0, 1] as well as uint8 RGB(A)
+    vertex_colors = np.asarray(vertex_colors)
+    if not np.issubdtype(vertex_colors.dtype, np.integer):
+        vertex_colors = np.clip(vertex_colors * 255.0 + 0.5, 0, 255)
+    vertex_colors = vertex_colors.astype(np.uint8)
+    if vertex_colors.shape[1] == 3:
+        alpha = np.full((vertex_colors.shape[0], 1), 255, dtype=np.uint8)
+        vertex_colors = np.concatenate([vertex_colors, alpha], axis=1)
+    return vertex_colors
+
+
+def face_normals(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    tris = vertices[faces]
+    normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.maximum(norm, 1e-12)
+
+
+def write_obj(
+    path: str,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    vertex_colors: Optional[np.ndarray] = None,
+) -> None:
+    # format every line of a block with a single %-operation instead of
+    # going through the per-element writer loop
+    if vertex_colors is not None:
+        colors = _as_rgba8(vertex_colors)[:, :3].astype(np.float64) / 255.0
+        v_data = np.concatenate([vertices, colors], axis=1)
+        v_line = "v %.8f %.8f %.8f %.4f %.4f %.4f\n"
+    else:
+        v_data = vertices
+        v_line = "v %.8f %.8f %.8f\n"
+    v_text = (v_line * v_data.shape[0]) % tuple(v_data.ravel().tolist())
+    # OBJ indices are 1-based
+    f_text = ("f %d %d %d\n" * faces.shape[0]) % tuple((faces + 1).ravel().tolist())
+    with open(path, "w") as f:
+        f.write(v_text)
+        f.write(f_text)
+
+
+def write_stl(path: str, vertices: np.ndarray, faces: np.ndarray) -> None:
+    # binary STL: 80 byte header, face count, then one packed record per face
+    record = np.dtype(
+        [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")]
+    )
+    data = np.zeros(faces.shape[0], dtype=record)
+    data["normal"] = face_normals(vertices, faces)
+    data["vertices"] = vertices[faces]
+    with open(path, "wb") as f:
+        f.write(b"\0" * 80)
+        f.write(np.uint32(faces.shape[0]).tobytes())
+        f.write(data.tobytes())
+
+
+def write_ply(
+    path: str,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    vertex_colors: Optional[np.ndarray] = None,
+) -> None:
+    vertex_fields = [("position", "<f4", (3,))]
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {vertices.shape[0]}",
+        "property float x",
+        "property float y",
+        "property float z",
+    ]
+    if vertex_colors is not None:
+        vertex_fields.append(("color", "u1", (4,)))
+        header += [
+            "property uchar red",
+            "property uchar green",
+            "property uchar blue",
+            "property uchar alpha",
+        ]
+    header += [
+        f"element face {faces.shape[0]}",
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]
+
+    vertex_data = np.empty(vertices.shape[0], dtype=np.dtype(vertex_fields))
+    vertex_data["position"] = vertices
+    if vertex_colors is not None:
+        vertex_data["color"] = _as_rgba8(vertex_colors)
+
+    face_data = np.empty(
+        faces.shape[0], dtype=np.dtype([("count", "u1"), ("indices", "<i4", (3,))])
+    )
+    face_data["count"] = 3
+    face_data["indices"] = faces
+
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
+
+
+# glTF constants
+_GL_BYTE = 5120
+_GL_UNSIGNED_BYTE = 5121
+_GL_SHORT = 5122
+_GL_UNSIGNED_SHORT = 5123
+_GL_UNSIGNED_INT = 5125
+_GL_FLOAT = 5126
+_GL_ARRAY_BUFFER = 34962
+_GL_ELEMENT_ARRAY_BUFFER = 34963
+
+
+class _GLBBuilder:
+    def __init__(self):
+        self.chunks = []
+        self.byte_length = 0
+        self.buffer_views = []
+        self.accessors = []
+
+    def add_buffer_view(
+        self,
+        data: np.ndarray,
+        target: Optional[int] = None,
+        byte_stride: Optional[int] = None,
+    ) -> int:
+        # every buffer view starts 4-byte aligned
+        padding = (-self.byte_length) % 4
+        if padding:
+            self.chunks.append(b"\0" * padding)
+            self.byte_length += padding
+        data = data if isinstance(data, bytes) else np.ascontiguousarray(data).tobytes()
+        view = {"buffer": 0, "byteOffset": self.byte_length, "byteLength": len(data)}
+        if target is not None:
+            view["target"] = target
+        if byte_stride is not None:
+            view["byteStride"] = byte_stride
+        self.chunks.append(data)
+        self.byte_length += len(data)
+        self.buffer_views.append(view)
+        return len(self.buffer_views) - 1
+
+    def add_accessor(
+        self,
+        buffer_view: int,
+        byte_offset: int,
+        component_type: int,
+        accessor_type: str,
+        count: int,
+        normalized: bool = False,
+        bounds: Optional[np.ndarray] = None,
+    ) -> int:
+        accessor = {
+            "bufferView": buffer_view,
+            "byteOffset": byte_offset,
+            "componentType": component_type,
+            "count": count,
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if bounds is not None:
+            accessor["min"] = bounds.min(axis=0).tolist()
+            accessor["max"] = bounds.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def write(self, path: str, gltf: dict) -> None:
+        gltf["buffers"] = [{"byteLength": self.byte_length}]
+        gltf["bufferViews"] = self.buffer_views
+        gltf["accessors"] = self.accessors
+
+        json_chunk = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+        json_chunk += b" " * ((-len(json_chunk)) % 4)
+        bin_chunk = b"".join(self.chunks)
+        bin_chunk += b"\0" * ((-len(bin_chunk)) % 4)
+
+        total_length = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sII", b"glTF", 2, total_length))
+            f.write(struct.pack("<I4s", len(json_chunk), b"JSON"))
+            f.write(json_chunk)
+            f.write(struct.pack("<I4s", len(bin_chunk), b"BIN\0"))
+            f.write(bin_chunk)
+
+
+def _split_for_uint16(faces: np.ndarray, max_vertices: int = 65535):
+    # split the faces into consecutive blocks that each reference at most
+    # max_vertices vertices; marching cubes emits faces with good locality so
+    # few vertices end up duplicated across blocks
+    blocks = []
+    pending = [faces]
+    while pending:
+        block = pending.pop(0)
+        vertex_ids, local_faces = np.unique(block, return_inverse=True)
+        if vertex_ids.shape[0] <= max_vertices:
+            blocks.append((vertex_ids, local_faces.reshape(-1, 3)))
+        else:
+            half = block.shape[0] // 2
+            pending[:0] = [block[:half], block[half:]]
+    return blocks
+
+
+def write_glb(
+    path: str,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    vertex_colors: Optional[np.ndarray] = None,
+    vertex_normals: Optional[np.ndarray] = None,
+    uvs: Optional[np.ndarray] = None,
+    texture: Optional[np.ndarray] = None,
+    position_dtype: str = "uint16",
+    index_dtype: str = "auto",
+) -> None:
+    """
+    Write a binary glTF file.
+
+    Args:
+        position_dtype: "float32", or "uint16" / "int16" to store quantized
+            positions (KHR_mesh_quantization). Quantized files also store
+            normals as int8 and UVs as uint16.
+        index_dtype: "uint32", "uint16" or "auto". With "uint16" meshes with
+            more than 65535 vertices are split into several primitives; "auto"
+            does the same, "uint32" always writes a single primitive.
+        texture: (H, W, 3 or 4) image in [0, 1] or uint8, embedded as PNG. Its
+            first row maps to v = 0, as in the baked texture atlas.
+    """
+    assert position_dtype in ["float32", "uint16", "int16"]
+    assert index_dtype in ["auto", "uint16", "uint32"]
+    vertices = np.asarray(vertices, dtype=np.float32)
+    faces = np.asarray(faces)
+    quantized = position_dtype != "float32"
+
+    if index_dtype == "uint32":
+        blocks = [(np.arange(vertices.shape[0]), faces)]
+    elif vertices.shape[0] <= 65535:
+        blocks = [(np.arange(vertices.shape[0]), faces)]
+        index_dtype = "uint16"
+    else:
+        blocks = _split_for_uint16(faces)
+        index_dtype = "uint16"
+    vertex_ids = np.concatenate([ids for ids, _ in blocks])
+    n_vertices = vertex_ids.shape[0]
+
+    builder = _GLBBuilder()
+    gltf = {"asset": {"version": "2.0", "generator": "TripoSR"}}
+    node = {"mesh": 0}
+    # (attribute name, buffer view, byte stride, component type, type, normalized, bounds source)
+    attributes = []
+
+    if quantized:
+        # quantize on a uniform grid over the bounding box and let the node
+        # transform map it back; uniform so normals need no correction
+        bbox_min = vertices.min(axis=0)
+        extent = max(float((vertices.max(axis=0) - bbox_min).max()), 1e-8)
+        if position_dtype == "uint16":
+            q_min, q_range, component_type = 0, 65535, _GL_UNSIGNED_SHORT
+        else:
+            q_min, q_range, component_type = -32767, 65534, _GL_SHORT
+        scale = extent / q_range
+        # pad to 8 bytes per vertex, attributes must be 4-byte aligned
+        q_pos = np.zeros((n_vertices, 4), dtype=position_dtype)
+        q_pos[:, :3] = np.round((vertices[vertex_ids] - bbox_min) / scale) + q_min
+        view = builder.add_buffer_view(q_pos, _GL_ARRAY_BUFFER, 8)
+        attributes.append(("POSITION", view, 8, component_type, "VEC3", False, q_pos[:, :3]))
+        node["translation"] = (bbox_min - q_min * scale).tolist()
+        node["scale"] = [scale] * 3
+        gltf["extensionsUsed"] = ["KHR_mesh_quantization"]
+        gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+    else:
+        positions = vertices[vertex_ids]
+        view = builder.add_buffer_view(positions, _GL_ARRAY_BUFFER)
+        attributes.append(("POSITION", view, 12, _GL_FLOAT, "VEC3", False, positions))
+
+    if vertex_normals is not None:
+        normals = np.asarray(vertex_normals, dtype=np.float32)[vertex_ids]
+        if quantized:
+            q_normals = np.zeros((n_vertices, 4), dtype=np.int8)
+            q_normals[:, :3] = np.round(np.clip(normals, -1, 1) * 127)
+            view = builder.add_buffer_view(q_normals, _GL_ARRAY_BUFFER, 4)
+            attributes.append(("NORMAL", view, 4, _GL_BYTE, "VEC3", True, None))
+        else:
+            view = builder.add_buffer_view(normals, _GL_ARRAY_BUFFER)
+            attributes.append(("NORMAL", view, 12, _GL_FLOAT, "VEC3", False, None))
+
+    if vertex_colors is not None:
+        colors = _as_rgba8(vertex_colors)[vertex_ids]
+        view = builder.add_buffer_view(colors, _GL_ARRAY_BUFFER)
+        attributes.append(("COLOR_0", view, 4, _GL_UNSIGNED_BYTE, "VEC4", True, None))
+
+    if uvs is not None:
+        uvs = np.asarray(uvs, dtype=np.float32)[vertex_ids]
+        if quantized:
+            q_uvs = np.round(np.clip(uvs, 0, 1) * 65535).astype(np.uint16)
+            view = builder.add_buffer_view(q_uvs, _GL_ARRAY_BUFFER)
+            attributes.append(("TEXCOORD_0", view, 4, _GL_UNSIGNED_SHORT, "VEC2", True, None))
+        else:
+            view = builder.add_buffer_view(uvs, _GL_ARRAY_BUFFER)
+            attributes.append(("TEXCOORD_0", view, 8, _GL_FLOAT, "VEC2", False, None))
+
+    index_view = builder.add_buffer_view(
+        np.concatenate([local.reshape(-1) for _, local in blocks]).astype(index_dtype),
+        _GL_ELEMENT_ARRAY_BUFFER,
+    )
+    index_size = np.dtype(index_dtype).itemsize
+
+    primitives = []
+    vertex_offset, index_offset = 0, 0
+    for ids, local in blocks:
+        count = ids.shape[0]
+        primitive_attributes = {}
+        for name, view, stride, component_type, accessor_type, normalized, bounds in attributes:
+            primitive_attributes[name] = builder.add_accessor(
+                view,
+                vertex_offset * stride,
+                component_type,
+                accessor_type,
+                count,
+                normalized=normalized,
+                bounds=(
+                    bounds[vertex_offset : vertex_offset + count]
+                    if bounds is not None
+                    else None
+                ),
+            )
+        indices = builder.add_accessor(
+            index_view,
+            index_offset * index_size,
+            _GL_UNSIGNED_SHORT if index_dtype == "uint16" else _GL_UNSIGNED_INT,
+            "SCALAR",
+            local.size,
+        )
+        primitives.append(
+            {"attributes": primitive_attributes, "indices": indices, "material": 0}
+        )
+        vertex_offset += count
+        index_offset += local.size
+
+    # a non-metallic material, the glTF default (fully metallic) renders dark
+    material = {
+        "pbrMetallicRoughness": {"metallicFactor": 0.0, "roughnessFactor": 1.0},
+        "doubleSided": True,
+    }
+    if texture is not None:
+        texture = np.asarray(texture)
+        if not np.issubdtype(texture.dtype, np.integer):
+            texture = np.clip(texture * 255.0 + 0.5, 0, 255)
+        png = io.BytesIO()
+        Image.fromarray(texture.astype(np.uint8)).save(png, format="PNG")
+        gltf["images"] = [
+            {"bufferView": builder.add_buffer_view(png.getvalue()), "mimeType": "image/png"}
+        ]
+        gltf["samplers"] = [{"magFilter": 9729, "minFilter": 9729}]
+        gltf["textures"] = [{"source": 0, "sampler": 0}]
+        material["pbrMetallicRoughness"]["baseColorTexture"] = {"index": 0}
+
+    gltf["materials"] = [material]
+    gltf["meshes"] = [{"primitives": primitives}]
+    gltf["nodes"] = [node]
+    gltf["scenes"] = [{"nodes": [0]}]
+    gltf["scene"] = 0
+    builder.write(path, gltf)
+
+
+MESH_WRITERS: Dict[str, Callable] = {
+    "obj": write_obj,
+    "stl": write_stl,
+    "ply": write_ply,
+    "glb": write_glb,
+}
+
+
+def export_mesh(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    paths: Dict[str, str],
+    vertex_colors: Optional[np.ndarray] = None,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+) -> Dict[str, int]:
+    """
+    Write the mesh to every requested format concurrently.
+
+    Args:
+        paths: maps a format ("obj", "stl", "ply" or "glb") to its output path.
+        on_error: called with the format and the exception when a writer fails,
+            instead of raising. The partial file is removed and the format is
+            left out of the returned sizes. It may re-raise for required formats.
+
+    Returns:
+        The size in bytes of every written file, keyed by format.
+    """
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    faces = np.ascontiguousarray(faces, dtype=np.int32)
+
+    def write(fmt: str, path: str) -> None:
+        if fmt not in MESH_WRITERS:
+            raise ValueError(
+                f"Unsupported mesh format: {fmt}, expected one of {list(MESH_WRITERS)}"
+            )
+        if fmt == "stl":
+            MESH_WRITERS[fmt](path, vertices, faces)
+        else:
+            MESH_WRITERS[fmt](path, vertices, faces, vertex_colors)
+
+    sizes = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(paths))) as executor:
+        futures = {
+            fmt: executor.submit(write, fmt, path) for fmt, path in paths.items()
+        }
+        for fmt, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                if on_error is None:
+                    raise
+                if os.path.exists(paths[fmt]):
+                    os.remove(paths[fmt])
+                on_error(fmt, e)
+            else:
+                sizes[fmt] = os.path.getsize(paths[fmt])
+
+    return sizes
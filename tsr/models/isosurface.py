@@ -3,8 +3,11 @@ from typing import Callable, Optional, Tuple
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchmcubes import marching_cubes
 
+from ..utils import chunk_batch
+
 
 class IsosurfaceHelper(nn.Module):
     points_range: Tuple[float, float] = (0, 1)
@@ -50,3 +53,32 @@ class MarchingCubeHelper(IsosurfaceHelper):
         v_pos = v_pos[..., [2, 1, 0]]
         v_pos = v_pos / (self.resolution - 1.0)
         return v_pos.to(level.device), t_pos_idx.to(level.device)
+
+    def vertex_normals(
+        self,
+        level: torch.FloatTensor,
+        v_pos: torch.FloatTensor,
+        chunk_size: int = 65536,
+    ) -> torch.FloatTensor:
+        # central differences of the level field, sampled trilinearly one voxel
+        # away from each vertex; the level grows outwards so its gradient is the normal
+        volume = level.view(1, 1, self.resolution, self.resolution, self.resolution)
+        step = 2.0 / (self.resolution - 1.0)
+        offsets = torch.eye(3, dtype=volume.dtype, device=volume.device) * step
+        offsets = torch.cat([offsets, -offsets], dim=0)
+
+        def _normals(v: torch.FloatTensor) -> torch.FloatTensor:
+            v = (v - self.points_range[0]) / (self.points_range[1] - self.points_range[0])
+            # grid_sample expects (x, y, z) = (W, H, D), i.e. reversed grid dims
+            grid = (v[:, [2, 1, 0]] * 2.0 - 1.0)[:, None, :] + offsets[None]
+            samples = F.grid_sample(
+                volume,
+                grid.view(1, -1, 1, 1, 3).to(volume.dtype),
+                mode="bilinear",
+                padding_mode="border",
+                align_corners=True,
+            ).view(-1, 6)
+            grad = (samples[:, :3] - samples[:, 3:])[:, [2, 1, 0]]
+            return F.normalize(grad, dim=-1)
+
+        return chunk_batch(_normals, chunk_size, v_pos.to(volume.device))
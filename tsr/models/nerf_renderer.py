@@ -1,5 +1,8 @@
+import os
+import time
 from dataclasses import dataclass
-from typing import Dict
+from functools import partial
+from typing import Dict, Optional, Tuple, Union
 
 import torch
 import torch.nn.functional as F
@@ -7,12 +10,43 @@ from einops import rearrange, reduce
 
 from ..utils import (
     BaseModule,
+    autocast,
     chunk_batch,
     get_activation,
+    get_available_memory,
     rays_intersect_bbox,
     scale_tensor,
+    stream_batch,
 )
 
+# candidate chunk sizes for set_chunk_size("auto")
+AUTO_CHUNK_SIZES = tuple(2**i for i in range(12, 21))
+# share of the currently available memory a query may use by default
+MEMORY_BUDGET_FRACTION = 0.5
+# chunk size of compiled queries when chunking is disabled
+COMPILE_CHUNK_SIZE = 8192
+DEFAULT_COMPILE_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "tsr", "inductor"
+)
+
+
+def composite(
+    density_act: torch.Tensor, color: torch.Tensor, deltas: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    eps = 1e-10
+    alpha = 1 - torch.exp(-deltas * density_act)  # (N_rays, N_samples)
+    accum_prod = torch.cat(
+        [
+            torch.ones_like(alpha[:, :1]),
+            torch.cumprod(1 - alpha[:, :-1] + eps, dim=-1),
+        ],
+        dim=-1,
+    )
+    weights = alpha * accum_prod  # (N_rays, N_samples)
+    comp_rgb = (weights[..., None] * color).sum(dim=-2)  # (N_rays, 3)
+    opacity = weights.sum(dim=-1)  # (N_rays)
+    return comp_rgb, opacity
+
 
 class TriplaneNeRFRenderer(BaseModule):
     @dataclass
@@ -31,60 +65,230 @@ class TriplaneNeRFRenderer(BaseModule):
     def configure(self) -> None:
         assert self.cfg.feature_reduction in ["concat", "mean"]
         self.chunk_size = 0
+        self.auto_chunk_size = False
+        self.memory_budget: Optional[int] = None
+        self.autocast_dtype: Optional[torch.dtype] = None
+        self._chunk_profiles: Dict[
+            Tuple[torch.device, torch.dtype, Optional[torch.dtype]], Dict
+        ] = {}
+        self._compiled_query = None
+        self._composite = composite
 
-    def set_chunk_size(self, chunk_size: int):
+    def enable_compile(self, cache_dir: Optional[str] = DEFAULT_COMPILE_CACHE_DIR):
+        """
+        Compile the per-chunk query (scaling, grid sampling, decoder, activations)
+        and the compositing step. Inductor's graph cache is kept in cache_dir so
+        that restarts skip recompilation.
+        """
+        if cache_dir is not None:
+            from torch._inductor import config as inductor_config
+
+            os.makedirs(cache_dir, exist_ok=True)
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+            inductor_config.fx_graph_cache = True
+        # the chunk dimension is dynamic: "auto" chunk sizes and the shorter
+        # last chunk of every query reuse one graph
+        self._compiled_query = torch.compile(self._query_positions, dynamic=True)
+        # the number of rays hitting the bbox varies per view
+        self._composite = torch.compile(composite, dynamic=True)
+
+    def set_chunk_size(
+        self, chunk_size: Union[int, str], memory_budget: Optional[int] = None
+    ):
+        """
+        chunk_size="auto" profiles the decoder on first use for every device/dtype
+        and picks the largest fast chunk that fits memory_budget bytes
+        (default: MEMORY_BUDGET_FRACTION of the memory available at query time).
+        """
+        if chunk_size == "auto":
+            self.auto_chunk_size = True
+            self.memory_budget = memory_budget
+            self._chunk_profiles = {}
+            return
         assert (
-            chunk_size >= 0
-        ), "chunk_size must be a non-negative integer (0 for no chunking)."
+            isinstance(chunk_size, int) and chunk_size >= 0
+        ), "chunk_size must be a non-negative integer (0 for no chunking) or 'auto'."
+        self.auto_chunk_size = False
         self.chunk_size = chunk_size
 
-    def query_triplane(
-        self,
-        decoder: torch.nn.Module,
-        positions: torch.Tensor,
-        triplane: torch.Tensor,
+    def set_autocast_dtype(self, dtype: Optional[torch.dtype]):
+        # the decoder runs under autocast, density activation and compositing stay fp32
+        self.autocast_dtype = dtype
+
+    def get_memory_budget(self, device: torch.device) -> int:
+        if self.memory_budget is not None:
+            return self.memory_budget
+        return int(get_available_memory(device) * MEMORY_BUDGET_FRACTION)
+
+    def _query_chunk(
+        self, decoder: torch.nn.Module, triplane: torch.Tensor, x: torch.Tensor
     ) -> Dict[str, torch.Tensor]:
-        input_shape = positions.shape[:-1]
-        positions = positions.view(-1, 3)
+        indices2D: torch.Tensor = torch.stack(
+            (x[..., [0, 1]], x[..., [0, 2]], x[..., [1, 2]]),
+            dim=-3,
+        )
+        out: torch.Tensor = F.grid_sample(
+            rearrange(triplane, "Np Cp Hp Wp -> Np Cp Hp Wp", Np=3),
+            rearrange(indices2D, "Np N Nd -> Np () N Nd", Np=3),
+            align_corners=False,
+            mode="bilinear",
+        )
+        if self.cfg.feature_reduction == "concat":
+            out = rearrange(out, "Np Cp () N -> N (Np Cp)", Np=3)
+        elif self.cfg.feature_reduction == "mean":
+            out = reduce(out, "Np Cp () N -> N Cp", Np=3, reduction="mean")
+        else:
+            raise NotImplementedError
+
+        net_out: Dict[str, torch.Tensor] = decoder(out)
+        return net_out
+
+    def _query_positions(
+        self, decoder: torch.nn.Module, triplane: torch.Tensor, positions: torch.Tensor
+    ) -> Dict[str, torch.Tensor]:
+        # scaling and activations run per chunk so that only the final outputs
+        # are ever allocated at full size
 
         # positions in (-radius, radius)
         # normalized to (-1, 1) for grid sample
         positions = scale_tensor(
             positions, (-self.cfg.radius, self.cfg.radius), (-1, 1)
         )
-
-        def _query_chunk(x):
-            indices2D: torch.Tensor = torch.stack(
-                (x[..., [0, 1]], x[..., [0, 2]], x[..., [1, 2]]),
-                dim=-3,
-            )
-            out: torch.Tensor = F.grid_sample(
-                rearrange(triplane, "Np Cp Hp Wp -> Np Cp Hp Wp", Np=3),
-                rearrange(indices2D, "Np N Nd -> Np () N Nd", Np=3),
-                align_corners=False,
-                mode="bilinear",
-            )
-            if self.cfg.feature_reduction == "concat":
-                out = rearrange(out, "Np Cp () N -> N (Np Cp)", Np=3)
-            elif self.cfg.feature_reduction == "mean":
-                out = reduce(out, "Np Cp () N -> N Cp", Np=3, reduction="mean")
-            else:
-                raise NotImplementedError
-
-            net_out: Dict[str, torch.Tensor] = decoder(out)
-            return net_out
-
-        if self.chunk_size > 0:
-            net_out = chunk_batch(_query_chunk, self.chunk_size, positions)
-        else:
-            net_out = _query_chunk(positions)
-
+        with autocast(positions.device.type, self.autocast_dtype):
+            net_out = self._query_chunk(decoder, triplane, positions)
+        net_out = {k: v.float() for k, v in net_out.items()}
         net_out["density_act"] = get_activation(self.cfg.density_activation)(
             net_out["density"] + self.cfg.density_bias
         )
         net_out["color"] = get_activation(self.cfg.color_activation)(
             net_out["features"]
         )
+        return net_out
+
+    def profile_chunk_sizes(
+        self, decoder: torch.nn.Module, triplane: torch.Tensor
+    ) -> Dict:
+        # warm-up sweep over AUTO_CHUNK_SIZES measuring the working memory per
+        # point and the throughput, cached per device, dtype and autocast dtype
+        key = (triplane.device, triplane.dtype, self.autocast_dtype)
+        if key in self._chunk_profiles:
+            return self._chunk_profiles[key]
+
+        device = triplane.device
+        budget = self.get_memory_budget(device)
+        positions = torch.rand(
+            AUTO_CHUNK_SIZES[0], 3, device=device, dtype=triplane.dtype
+        ) * 2 - 1
+
+        # working memory of one point: every intermediate activation, measured
+        # by the allocator on CUDA and by summing module outputs elsewhere
+        activation_bytes = [positions.element_size() * positions.shape[-1] * 4]
+
+        def _hook(module, inputs, output):
+            if isinstance(output, torch.Tensor):
+                activation_bytes.append(output[:1].numel() * output.element_size())
+
+        handles = [m.register_forward_hook(_hook) for m in decoder.modules()]
+        with torch.no_grad(), autocast(device.type, self.autocast_dtype):
+            net_out = self._query_chunk(decoder, triplane, positions)
+        for handle in handles:
+            handle.remove()
+        bytes_per_point = sum(activation_bytes) + triplane.element_size() * (
+            triplane.shape[0] * triplane.shape[1]
+        )
+        # stored results per point: decoder outputs plus their activations, kept
+        # in fp32 (see _query_positions)
+        output_bytes_per_point = 2 * sum(4 * v.shape[-1] for v in net_out.values())
+
+        throughput = {}
+        for chunk_size in AUTO_CHUNK_SIZES:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+                torch.cuda.reset_peak_memory_stats(device)
+                allocated = torch.cuda.memory_allocated(device)
+            elif chunk_size * bytes_per_point > budget:
+                break
+            x = torch.rand(chunk_size, 3, device=device, dtype=triplane.dtype) * 2 - 1
+            start = time.perf_counter()
+            with torch.no_grad(), autocast(device.type, self.autocast_dtype):
+                self._query_chunk(decoder, triplane, x)
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+                peak = torch.cuda.max_memory_allocated(device) - allocated
+                bytes_per_point = max(bytes_per_point, peak / chunk_size)
+            throughput[chunk_size] = chunk_size / max(time.perf_counter() - start, 1e-9)
+            if chunk_size * bytes_per_point * 2 > budget:
+                break
+            # stop once larger chunks no longer pay off
+            if len(throughput) > 2 and throughput[chunk_size] < 1.05 * max(
+                list(throughput.values())[:-1]
+            ):
+                break
+
+        if throughput:
+            best = max(throughput.values())
+            # chunk sizes within 10% of the best throughput, largest last
+            chunk_sizes = sorted(c for c, t in throughput.items() if t >= 0.9 * best)
+        else:
+            # the budget does not even fit the smallest chunk
+            chunk_sizes = [AUTO_CHUNK_SIZES[0]]
+        profile = {
+            "bytes_per_point": bytes_per_point,
+            "output_bytes_per_point": output_bytes_per_point,
+            "chunk_sizes": chunk_sizes,
+            "throughput": throughput,
+        }
+        self._chunk_profiles[key] = profile
+        return profile
+
+    def get_chunk_size(
+        self, decoder: torch.nn.Module, triplane: torch.Tensor, n_points: int
+    ) -> int:
+        if not self.auto_chunk_size:
+            return self.chunk_size
+        profile = self.profile_chunk_sizes(decoder, triplane)
+        # the full result of the query stays resident next to the working chunk
+        available = (
+            self.get_memory_budget(triplane.device)
+            - n_points * profile["output_bytes_per_point"]
+        )
+        fitting = [
+            c for c in profile["chunk_sizes"] if c * profile["bytes_per_point"] <= available
+        ]
+        chunk_size = fitting[-1] if fitting else AUTO_CHUNK_SIZES[0]
+        self.chunk_size = chunk_size
+        return chunk_size
+
+    def query_triplane(
+        self,
+        decoder: torch.nn.Module,
+        positions: torch.Tensor,
+        triplane: torch.Tensor,
+        output_device: Optional[Union[str, torch.device]] = None,
+    ) -> Dict[str, torch.Tensor]:
+        input_shape = positions.shape[:-1]
+        positions = positions.view(-1, 3)
+        output_device = torch.device(output_device or triplane.device)
+
+        # full results only stay resident on the triplane's device when returned there
+        chunk_size = self.get_chunk_size(
+            decoder,
+            triplane,
+            positions.shape[0] if output_device == triplane.device else 0,
+        )
+        query = partial(self._query_positions, decoder, triplane)
+        if self._compiled_query is not None:
+            chunk_size = chunk_size if chunk_size > 0 else COMPILE_CHUNK_SIZE
+            query = partial(self._compiled_query, decoder, triplane)
+        if positions.device != triplane.device or output_device != triplane.device:
+            # stream inputs to and outputs from the triplane's device chunk by chunk
+            net_out = stream_batch(
+                query, chunk_size, positions, triplane.device, output_device
+            )
+        elif chunk_size > 0:
+            net_out = chunk_batch(query, chunk_size, positions)
+        else:
+            net_out = query(positions)
 
         net_out = {k: v.view(*input_shape, -1) for k, v in net_out.items()}
 
@@ -122,22 +326,11 @@ class TriplaneNeRFRenderer(BaseModule):
             triplane=triplane,
         )
 
-        eps = 1e-10
         # deltas = z_vals[:, 1:] - z_vals[:, :-1] # (N_rays, N_samples)
         deltas = t_vals[1:] - t_vals[:-1]  # (N_rays, N_samples)
-        alpha = 1 - torch.exp(
-            -deltas * mlp_out["density_act"][..., 0]
-        )  # (N_rays, N_samples)
-        accum_prod = torch.cat(
-            [
-                torch.ones_like(alpha[:, :1]),
-                torch.cumprod(1 - alpha[:, :-1] + eps, dim=-1),
-            ],
-            dim=-1,
+        comp_rgb_, opacity_ = self._composite(
+            mlp_out["density_act"][..., 0], mlp_out["color"], deltas
         )
-        weights = alpha * accum_prod  # (N_rays, N_samples)
-        comp_rgb_ = (weights[..., None] * mlp_out["color"]).sum(dim=-2)  # (N_rays, 3)
-        opacity_ = weights.sum(dim=-1)  # (N_rays)
 
         comp_rgb = torch.zeros(
             n_rays, 3, dtype=comp_rgb_.dtype, device=comp_rgb_.device
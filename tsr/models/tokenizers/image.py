@@ -1,58 +1,167 @@
+import os
 from dataclasses import dataclass
+from typing import Optional
 
 import torch
 import torch.nn as nn
 from einops import rearrange
-from huggingface_hub import hf_hub_download
 from transformers.models.vit.modeling_vit import ViTModel
 
 from ...utils import BaseModule
 
+# ViT configs shipped with the package, so construction needs no network access
+BUNDLED_CONFIGS = {
+    "facebook/dino-vitb16": os.path.join(os.path.dirname(__file__), "dino-vitb16.json"),
+}
+
+# patches within this distance of the gray (0.5) background fill are dropped
+BACKGROUND_TOLERANCE = 1.0 / 255.0
+
+
+def vit_config_path(pretrained_model_name_or_path: str) -> str:
+    # local directory > bundled copy > huggingface cache > download
+    if os.path.isdir(pretrained_model_name_or_path):
+        return os.path.join(pretrained_model_name_or_path, "config.json")
+    if pretrained_model_name_or_path in BUNDLED_CONFIGS:
+        return BUNDLED_CONFIGS[pretrained_model_name_or_path]
+
+    from huggingface_hub import hf_hub_download, try_to_load_from_cache
+
+    cached = try_to_load_from_cache(pretrained_model_name_or_path, "config.json")
+    if isinstance(cached, str):
+        return cached
+    return hf_hub_download(repo_id=pretrained_model_name_or_path, filename="config.json")
+
 
 class DINOSingleImageTokenizer(BaseModule):
     @dataclass
     class Config(BaseModule.Config):
         pretrained_model_name_or_path: str = "facebook/dino-vitb16"
         enable_gradient_checkpointing: bool = False
+        # drop all-background patch tokens after this many ViT layers
+        prune_background: bool = False
+        prune_background_layer: int = 4
 
     cfg: Config
 
     def configure(self) -> None:
         self.model: ViTModel = ViTModel(
             ViTModel.config_class.from_pretrained(
-                hf_hub_download(
-                    repo_id=self.cfg.pretrained_model_name_or_path,
-                    filename="config.json",
-                )
+                vit_config_path(self.cfg.pretrained_model_name_or_path)
             )
         )
 
         if self.cfg.enable_gradient_checkpointing:
             self.model.encoder.gradient_checkpointing = True
 
+        # not in the checkpoint, so created on the CPU even when the model is
+        # constructed on the meta device
         self.register_buffer(
             "image_mean",
-            torch.as_tensor([0.485, 0.456, 0.406]).reshape(1, 1, 3, 1, 1),
+            torch.as_tensor([0.485, 0.456, 0.406], device="cpu").reshape(
+                1, 1, 3, 1, 1
+            ),
             persistent=False,
         )
         self.register_buffer(
             "image_std",
-            torch.as_tensor([0.229, 0.224, 0.225]).reshape(1, 1, 3, 1, 1),
+            torch.as_tensor([0.229, 0.224, 0.225], device="cpu").reshape(
+                1, 1, 3, 1, 1
+            ),
             persistent=False,
         )
+        self.set_background_pruning(
+            self.cfg.prune_background, self.cfg.prune_background_layer
+        )
+
+    def set_background_pruning(self, enabled: bool, layer: int = None) -> None:
+        self.prune_background = enabled
+        if layer is not None:
+            self.prune_background_layer = layer
 
-    def forward(self, images: torch.FloatTensor, **kwargs) -> torch.FloatTensor:
+    def foreground_patches(
+        self, images: torch.FloatTensor, masks: Optional[torch.FloatTensor] = None
+    ) -> torch.BoolTensor:
+        # patches with any foreground, union over the batch so the pruned
+        # sequence stays rectangular
+        patch_size = self.model.config.patch_size
+        h, w = images.shape[-2] // patch_size, images.shape[-1] // patch_size
+        if masks is not None:
+            # the alpha from background removal: any covered pixel keeps a patch
+            background = masks[..., : h * patch_size, : w * patch_size] <= 0
+        else:
+            # without a mask, a patch is background when all its pixels match
+            # the gray fill. Foreground that is itself flat mid-gray is dropped
+            # too, so callers that have the alpha should pass it
+            images = images[..., : h * patch_size, : w * patch_size]
+            background = (images - 0.5).abs() <= BACKGROUND_TOLERANCE
+        background = rearrange(
+            background,
+            "B C (h p1) (w p2) -> B (h w) (C p1 p2)",
+            p1=patch_size,
+            p2=patch_size,
+        ).all(dim=-1)
+        return ~background.all(dim=0)
+
+    def forward_pruned(
+        self, images: torch.FloatTensor, masks: Optional[torch.FloatTensor] = None
+    ) -> torch.FloatTensor:
+        keep = self.foreground_patches(images, masks)
+        if keep.all() or not keep.any():
+            return self.model(
+                (images - self.image_mean[0]) / self.image_std[0],
+                interpolate_pos_encoding=True,
+            ).last_hidden_state
+        # keep the CLS token and the foreground patches
+        keep = torch.cat([keep.new_ones(1), keep]).nonzero().squeeze(1)
+        hidden_states = self.model.embeddings(
+            (images - self.image_mean[0]) / self.image_std[0],
+            interpolate_pos_encoding=True,
+        )
+        layers = (
+            self.model.encoder.layer
+            if hasattr(self.model, "encoder")
+            else self.model.layers
+        )
+        for i, layer in enumerate(layers):
+            if i == self.prune_background_layer:
+                hidden_states = hidden_states[:, keep]
+            hidden_states = layer(hidden_states)
+            if isinstance(hidden_states, tuple):
+                hidden_states = hidden_states[0]
+        if self.prune_background_layer >= len(layers):
+            hidden_states = hidden_states[:, keep]
+        return self.model.layernorm(hidden_states)
+
+    def forward(
+        self,
+        images: torch.FloatTensor,
+        masks: Optional[torch.FloatTensor] = None,
+        **kwargs,
+    ) -> torch.FloatTensor:
         packed = False
         if images.ndim == 4:
             packed = True
             images = images.unsqueeze(1)
+            if masks is not None:
+                masks = masks.unsqueeze(1)
 
         batch_size, n_input_views = images.shape[:2]
-        images = (images - self.image_mean) / self.image_std
-        out = self.model(
-            rearrange(images, "B N C H W -> (B N) C H W"), interpolate_pos_encoding=True
-        )
-        local_features, global_features = out.last_hidden_state, out.pooler_output
+        if self.prune_background:
+            # fewer image tokens also shrink the backbone's cross-attention K/V
+            local_features = self.forward_pruned(
+                rearrange(images, "B N C H W -> (B N) C H W"),
+                None
+                if masks is None
+                else rearrange(masks, "B N C H W -> (B N) C H W"),
+            )
+        else:
+            images = (images - self.image_mean) / self.image_std
+            out = self.model(
+                rearrange(images, "B N C H W -> (B N) C H W"),
+                interpolate_pos_encoding=True,
+            )
+            local_features = out.last_hidden_state
         local_features = local_features.permute(0, 2, 1)
         local_features = rearrange(
             local_features, "(B N) Ct Nt -> B N Ct Nt", B=batch_size
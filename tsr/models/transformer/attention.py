@@ -121,6 +121,7 @@ class Attention(nn.Module):
         super().__init__()
         self.inner_dim = out_dim if out_dim is not None else dim_head * heads
         self.query_dim = query_dim
+        self.is_cross_attention = cross_attention_dim is not None
         self.cross_attention_dim = (
             cross_attention_dim if cross_attention_dim is not None else query_dim
         )
@@ -209,6 +210,11 @@ class Attention(nn.Module):
         self.to_out.append(linear_cls(self.inner_dim, self.out_dim, bias=out_bias))
         self.to_out.append(nn.Dropout(dropout))
 
+        # fused projections (see `fuse_projections`) are saved and loaded with
+        # the checkpoint's separate to_q / to_k / to_v keys
+        self._register_state_dict_hook(self._split_fused_state_dict)
+        self._register_load_state_dict_pre_hook(self._fuse_loaded_state_dict)
+
         # set attention processor
         # We use the AttnProcessor2_0 by default when torch 2.x is used which uses
         # torch.nn.functional.scaled_dot_product_attention for native Flash/memory_efficient_attention
@@ -448,9 +454,13 @@ class Attention(nn.Module):
 
     @torch.no_grad()
     def fuse_projections(self, fuse=True):
-        is_cross_attention = self.cross_attention_dim != self.query_dim
+        # fuse=False keeps the separate projections
+        if not fuse or self.fused_projections:
+            return
+        is_cross_attention = self.is_cross_attention
         device = self.to_q.weight.data.device
         dtype = self.to_q.weight.data.dtype
+        use_bias = self.to_q.bias is not None
 
         if not is_cross_attention:
             # fetch weight matrices.
@@ -462,9 +472,14 @@ class Attention(nn.Module):
 
             # create a new single projection layer and copy over the weights.
             self.to_qkv = self.linear_cls(
-                in_features, out_features, bias=False, device=device, dtype=dtype
+                in_features, out_features, bias=use_bias, device=device, dtype=dtype
             )
             self.to_qkv.weight.copy_(concatenated_weights)
+            if use_bias:
+                concatenated_bias = torch.cat(
+                    [self.to_q.bias.data, self.to_k.bias.data, self.to_v.bias.data]
+                )
+                self.to_qkv.bias.copy_(concatenated_bias)
 
         else:
             concatenated_weights = torch.cat(
@@ -474,11 +489,74 @@ class Attention(nn.Module):
             out_features = concatenated_weights.shape[0]
 
             self.to_kv = self.linear_cls(
-                in_features, out_features, bias=False, device=device, dtype=dtype
+                in_features, out_features, bias=use_bias, device=device, dtype=dtype
             )
             self.to_kv.weight.copy_(concatenated_weights)
+            if use_bias:
+                concatenated_bias = torch.cat(
+                    [self.to_k.bias.data, self.to_v.bias.data]
+                )
+                self.to_kv.bias.copy_(concatenated_bias)
+
+        # the fused layers replace the separate ones, keeping a single copy of
+        # the weights; every processor projects through `project_qkv`
+        if not is_cross_attention:
+            self.to_q = None
+        self.to_k = None
+        self.to_v = None
+
+        self.fused_projections = True
+
+    def _split_fused_state_dict(self, module, state_dict, prefix, local_metadata):
+        # state dicts keep the checkpoint layout with separate projections
+        if not self.fused_projections:
+            return
+        names = ["to_k", "to_v"] if self.is_cross_attention else ["to_q", "to_k", "to_v"]
+        fused = "to_kv" if self.is_cross_attention else "to_qkv"
+        for param in ["weight", "bias"]:
+            tensor = state_dict.pop(f"{prefix}{fused}.{param}", None)
+            if tensor is None:
+                continue
+            for name, chunk in zip(names, tensor.chunk(len(names))):
+                state_dict[f"{prefix}{name}.{param}"] = chunk
+
+    def _fuse_loaded_state_dict(self, state_dict, prefix, *args):
+        # checkpoints with separate projections load into fused layers
+        if not self.fused_projections:
+            return
+        names = ["to_k", "to_v"] if self.is_cross_attention else ["to_q", "to_k", "to_v"]
+        fused = "to_kv" if self.is_cross_attention else "to_qkv"
+        for param in ["weight", "bias"]:
+            keys = [f"{prefix}{name}.{param}" for name in names]
+            if all(k in state_dict for k in keys):
+                state_dict[f"{prefix}{fused}.{param}"] = torch.cat(
+                    [state_dict.pop(k) for k in keys]
+                )
 
-        self.fused_projections = fuse
+
+def project_qkv(
+    attn: Attention,
+    hidden_states: torch.FloatTensor,
+    encoder_hidden_states: Optional[torch.FloatTensor] = None,
+):
+    # query, key and value projections, through the fused layers built by
+    # `attn.fuse_projections()` when they exist
+    if encoder_hidden_states is None and attn.fused_projections and not attn.is_cross_attention:
+        return attn.to_qkv(hidden_states).chunk(3, dim=-1)
+
+    query = attn.to_q(hidden_states)
+
+    if encoder_hidden_states is None:
+        encoder_hidden_states = hidden_states
+    elif attn.norm_cross:
+        encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
+
+    if attn.fused_projections and attn.is_cross_attention:
+        key, value = attn.to_kv(encoder_hidden_states).chunk(2, dim=-1)
+    else:
+        key = attn.to_k(encoder_hidden_states)
+        value = attn.to_v(encoder_hidden_states)
+    return query, key, value
 
 
 class AttnProcessor:
@@ -517,17 +595,7 @@ class AttnProcessor:
                 1, 2
             )
 
-        query = attn.to_q(hidden_states)
-
-        if encoder_hidden_states is None:
-            encoder_hidden_states = hidden_states
-        elif attn.norm_cross:
-            encoder_hidden_states = attn.norm_encoder_hidden_states(
-                encoder_hidden_states
-            )
-
-        key = attn.to_k(encoder_hidden_states)
-        value = attn.to_v(encoder_hidden_states)
+        query, key, value = project_qkv(attn, hidden_states, encoder_hidden_states)
 
         query = attn.head_to_batch_dim(query)
         key = attn.head_to_batch_dim(key)
@@ -604,17 +672,99 @@ class AttnProcessor2_0:
                 1, 2
             )
 
-        query = attn.to_q(hidden_states)
+        query, key, value = project_qkv(attn, hidden_states, encoder_hidden_states)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        # the output of sdp = (batch, num_heads, seq_len, head_dim)
+        # TODO: add support for attn.scale when we move to Torch 2.1
+        hidden_states = F.scaled_dot_product_attention(
+            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+        )
 
-        if encoder_hidden_states is None:
-            encoder_hidden_states = hidden_states
-        elif attn.norm_cross:
-            encoder_hidden_states = attn.norm_encoder_hidden_states(
-                encoder_hidden_states
+        hidden_states = hidden_states.transpose(1, 2).reshape(
+            batch_size, -1, attn.heads * head_dim
+        )
+        hidden_states = hidden_states.to(query.dtype)
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        if input_ndim == 4:
+            hidden_states = hidden_states.transpose(-1, -2).reshape(
+                batch_size, channel, height, width
             )
 
-        key = attn.to_k(encoder_hidden_states)
-        value = attn.to_v(encoder_hidden_states)
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+
+        hidden_states = hidden_states / attn.rescale_output_factor
+
+        return hidden_states
+
+
+class FusedAttnProcessor2_0:
+    r"""
+    Processor for implementing scaled dot-product attention with fused projection layers. For self-attention, the
+    query, key and value projections are computed by a single GEMM (`attn.to_qkv`); for cross-attention, the key and
+    value projections of `encoder_hidden_states` are (`attn.to_kv`).
+
+    Requires `attn.fuse_projections()` to have been called, unfused projections are used otherwise.
+    """
+
+    def __init__(self):
+        if not hasattr(F, "scaled_dot_product_attention"):
+            raise ImportError(
+                "FusedAttnProcessor2_0 requires PyTorch 2.0, to use it, please upgrade PyTorch to 2.0."
+            )
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.FloatTensor,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+    ) -> torch.FloatTensor:
+        residual = hidden_states
+
+        input_ndim = hidden_states.ndim
+
+        if input_ndim == 4:
+            batch_size, channel, height, width = hidden_states.shape
+            hidden_states = hidden_states.view(
+                batch_size, channel, height * width
+            ).transpose(1, 2)
+
+        batch_size, sequence_length, _ = (
+            hidden_states.shape
+            if encoder_hidden_states is None
+            else encoder_hidden_states.shape
+        )
+
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(
+                attention_mask, sequence_length, batch_size
+            )
+            # scaled_dot_product_attention expects attention_mask shape to be
+            # (batch, heads, source_length, target_length)
+            attention_mask = attention_mask.view(
+                batch_size, attn.heads, -1, attention_mask.shape[-1]
+            )
+
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(
+                1, 2
+            )
+
+        query, key, value = project_qkv(attn, hidden_states, encoder_hidden_states)
 
         inner_dim = key.shape[-1]
         head_dim = inner_dim // attn.heads
@@ -625,7 +775,6 @@ class AttnProcessor2_0:
         value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
 
         # the output of sdp = (batch, num_heads, seq_len, head_dim)
-        # TODO: add support for attn.scale when we move to Torch 2.1
         hidden_states = F.scaled_dot_product_attention(
             query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
         )
@@ -651,3 +800,137 @@ class AttnProcessor2_0:
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
+
+
+class SlicedAttnProcessor:
+    r"""
+    Processor for implementing memory-efficient attention. Queries are processed `slice_size` at a time and keys and
+    values in blocks of `slice_size` with an online softmax, so at most `(batch, heads, slice_size, slice_size)`
+    attention scores are held in memory instead of the full `(batch, heads, query_length, key_length)` matrix.
+
+    Args:
+        slice_size (`int`, *optional*, defaults to 1024):
+            The number of query tokens, and key tokens per block, to compute attention scores for at a time.
+    """
+
+    def __init__(self, slice_size: int = 1024):
+        self.slice_size = slice_size
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.FloatTensor,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+    ) -> torch.FloatTensor:
+        residual = hidden_states
+
+        input_ndim = hidden_states.ndim
+
+        if input_ndim == 4:
+            batch_size, channel, height, width = hidden_states.shape
+            hidden_states = hidden_states.view(
+                batch_size, channel, height * width
+            ).transpose(1, 2)
+
+        batch_size, sequence_length, _ = (
+            hidden_states.shape
+            if encoder_hidden_states is None
+            else encoder_hidden_states.shape
+        )
+
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(
+                attention_mask, sequence_length, batch_size
+            )
+            attention_mask = attention_mask.view(
+                batch_size, attn.heads, -1, attention_mask.shape[-1]
+            )
+
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(
+                1, 2
+            )
+
+        query, key, value = project_qkv(attn, hidden_states, encoder_hidden_states)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        hidden_states = self.sliced_attention(
+            query, key, value, attention_mask, attn.scale
+        )
+
+        hidden_states = hidden_states.transpose(1, 2).reshape(
+            batch_size, -1, attn.heads * head_dim
+        )
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        if input_ndim == 4:
+            hidden_states = hidden_states.transpose(-1, -2).reshape(
+                batch_size, channel, height, width
+            )
+
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+
+        hidden_states = hidden_states / attn.rescale_output_factor
+
+        return hidden_states
+
+    def sliced_attention(
+        self,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        attention_mask: Optional[torch.Tensor],
+        scale: float,
+    ) -> torch.Tensor:
+        # (batch, heads, seq_len, head_dim) in and out; the running max, softmax
+        # denominator and output are accumulated in float32
+        query_length, key_length = query.shape[2], key.shape[2]
+        output = torch.empty_like(query)
+        for i in range(0, query_length, self.slice_size):
+            query_slice = query[:, :, i : i + self.slice_size] * scale
+            mask_slice = None
+            if attention_mask is not None:
+                mask_slice = (
+                    attention_mask
+                    if attention_mask.shape[2] == 1
+                    else attention_mask[:, :, i : i + self.slice_size]
+                )
+            running_max = running_sum = accumulated = None
+            for j in range(0, key_length, self.slice_size):
+                scores = torch.matmul(
+                    query_slice, key[:, :, j : j + self.slice_size].transpose(-1, -2)
+                ).float()
+                if mask_slice is not None:
+                    scores = scores + mask_slice[..., j : j + self.slice_size]
+                block_max = scores.amax(dim=-1, keepdim=True)
+                new_max = (
+                    block_max
+                    if running_max is None
+                    else torch.maximum(running_max, block_max)
+                )
+                probs = torch.exp(scores - new_max)
+                block_sum = probs.sum(dim=-1, keepdim=True)
+                block_output = torch.matmul(
+                    probs.to(value.dtype), value[:, :, j : j + self.slice_size]
+                ).float()
+                if running_max is None:
+                    running_sum, accumulated = block_sum, block_output
+                else:
+                    correction = torch.exp(running_max - new_max)
+                    running_sum = running_sum * correction + block_sum
+                    accumulated = accumulated * correction + block_output
+                running_max = new_max
+            output[:, :, i : i + self.slice_size] = accumulated / running_sum
+        return output
@@ -36,13 +36,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from typing import Optional
+from typing import Callable, Optional
 
 import torch
 import torch.nn.functional as F
 from torch import nn
 
 from .attention import Attention
+from .token_merge import bipartite_soft_matching, do_nothing
 
 
 class BasicTransformerBlock(nn.Module):
@@ -141,21 +142,37 @@ class BasicTransformerBlock(nn.Module):
         self._chunk_size = None
         self._chunk_dim = 0
 
+        # fraction of tokens merged before attention and feed-forward
+        self._token_merge_ratio = None
+
     def set_chunk_feed_forward(self, chunk_size: Optional[int], dim: int):
         # Sets chunk feed-forward
         self._chunk_size = chunk_size
         self._chunk_dim = dim
 
-    def forward(
+    def set_token_merge(self, ratio: Optional[float]):
+        self._token_merge_ratio = ratio
+
+    def token_merge(self, hidden_states: torch.FloatTensor):
+        if not self._token_merge_ratio:
+            return do_nothing, do_nothing
+        # similar tokens share one attention / feed-forward evaluation
+        n_tokens = hidden_states.shape[1]
+        r = min(int(n_tokens * self._token_merge_ratio), n_tokens // 2)
+        if self._chunk_size is not None and self._chunk_dim == 1:
+            # merge fewer tokens so the feed-forward chunks stay even
+            r -= -(n_tokens - r) % self._chunk_size
+        return bipartite_soft_matching(hidden_states, max(r, 0))
+
+    def self_attention(
         self,
         hidden_states: torch.FloatTensor,
+        merge: Callable = do_nothing,
+        unmerge: Callable = do_nothing,
         attention_mask: Optional[torch.FloatTensor] = None,
         encoder_hidden_states: Optional[torch.FloatTensor] = None,
-        encoder_attention_mask: Optional[torch.FloatTensor] = None,
     ) -> torch.FloatTensor:
-        # Notice that normalization is always applied before the real computation in the following blocks.
-        # 0. Self-Attention
-        norm_hidden_states = self.norm1(hidden_states)
+        norm_hidden_states = merge(self.norm1(hidden_states))
 
         attn_output = self.attn1(
             norm_hidden_states,
@@ -165,21 +182,41 @@ class BasicTransformerBlock(nn.Module):
             attention_mask=attention_mask,
         )
 
-        hidden_states = attn_output + hidden_states
+        return unmerge(attn_output) + hidden_states
+
+    def forward(
+        self,
+        hidden_states: torch.FloatTensor,
+        attention_mask: Optional[torch.FloatTensor] = None,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        encoder_attention_mask: Optional[torch.FloatTensor] = None,
+        self_attention_output: Optional[torch.FloatTensor] = None,
+    ) -> torch.FloatTensor:
+        merge, unmerge = self.token_merge(hidden_states)
+
+        # Notice that normalization is always applied before the real computation in the following blocks.
+        # 0. Self-Attention
+        if self_attention_output is not None:
+            # precomputed for input-independent hidden states
+            hidden_states = self_attention_output
+        else:
+            hidden_states = self.self_attention(
+                hidden_states, merge, unmerge, attention_mask, encoder_hidden_states
+            )
 
         # 3. Cross-Attention
         if self.attn2 is not None:
-            norm_hidden_states = self.norm2(hidden_states)
+            norm_hidden_states = merge(self.norm2(hidden_states))
 
             attn_output = self.attn2(
                 norm_hidden_states,
                 encoder_hidden_states=encoder_hidden_states,
                 attention_mask=encoder_attention_mask,
             )
-            hidden_states = attn_output + hidden_states
+            hidden_states = unmerge(attn_output) + hidden_states
 
         # 4. Feed-forward
-        norm_hidden_states = self.norm3(hidden_states)
+        norm_hidden_states = merge(self.norm3(hidden_states))
 
         if self._chunk_size is not None:
             # "feed_forward_chunk_size" can be used to save memory
@@ -201,7 +238,7 @@ class BasicTransformerBlock(nn.Module):
         else:
             ff_output = self.ff(norm_hidden_states)
 
-        hidden_states = ff_output + hidden_states
+        hidden_states = unmerge(ff_output) + hidden_states
 
         return hidden_states
 
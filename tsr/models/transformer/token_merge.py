@@ -0,0 +1,61 @@
+from typing import Callable, Tuple
+
+import torch
+
+
+def do_nothing(x: torch.Tensor) -> torch.Tensor:
+    return x
+
+
+def bipartite_soft_matching(
+    metric: torch.Tensor, r: int
+) -> Tuple[Callable, Callable]:
+    """
+    ToMe bipartite soft matching (Bolya et al., 2023) over a 1D token sequence.
+    Tokens alternate between a source and a destination set; the r source tokens
+    most similar (cosine) to a destination token are averaged into it.
+
+    Returns (merge, unmerge): merge maps (B, N, C) to (B, N - r, C), unmerge maps
+    the result back to (B, N, C) by copying each merged token to its sources.
+    """
+    batch_size, n_tokens, _ = metric.shape
+    r = min(r, n_tokens // 2)
+    if r <= 0:
+        return do_nothing, do_nothing
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[:, ::2], metric[:, 1::2]
+        scores = a @ b.transpose(-1, -2)
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+
+        unm_idx = edge_idx[:, r:]  # unmerged source tokens
+        src_idx = edge_idx[:, :r]  # merged source tokens
+        dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        src, dst = x[:, ::2], x[:, 1::2]
+        n, t, c = src.shape
+        unm = src.gather(dim=1, index=unm_idx.expand(n, t - r, c))
+        src = src.gather(dim=1, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(1, dst_idx.expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[:, :unm_len], x[:, unm_len:]
+        n, _, c = x.shape
+
+        out = x.new_empty(n, n_tokens, c)
+        out[:, 1::2] = dst
+        out.scatter_(1, (2 * unm_idx).expand(n, unm_len, c), unm)
+        out.scatter_(
+            1,
+            (2 * src_idx).expand(n, r, c),
+            dst.gather(dim=1, index=dst_idx.expand(n, r, c)),
+        )
+        return out
+
+    return merge, unmerge
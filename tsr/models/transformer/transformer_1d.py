@@ -37,15 +37,24 @@
 # SOFTWARE.
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, List, Optional
 
 import torch
 import torch.nn.functional as F
 from torch import nn
 
 from ...utils import BaseModule
+from .attention import (
+    Attention,
+    AttnProcessor,
+    AttnProcessor2_0,
+    FusedAttnProcessor2_0,
+    SlicedAttnProcessor,
+)
 from .basic_transformer_block import BasicTransformerBlock
 
+ATTENTION_PROCESSORS = ["sdpa", "sliced"]
+
 
 class Transformer1D(BaseModule):
     @dataclass
@@ -66,6 +75,15 @@ class Transformer1D(BaseModule):
         norm_type: str = "layer_norm"
         norm_elementwise_affine: bool = True
         gradient_checkpointing: bool = False
+        # "sliced" bounds attention scores to (batch, heads, slice, slice)
+        attention_processor: str = "sdpa"
+        attention_slice_size: int = 1024
+        # number of tokens per feed-forward chunk, must divide the (merged)
+        # sequence length
+        feed_forward_chunk_size: Optional[int] = None
+        # fraction of tokens merged in each selected block, None for all blocks
+        token_merge_ratio: float = 0.0
+        token_merge_layers: Optional[List[int]] = None
 
     cfg: Config
 
@@ -119,12 +137,105 @@ class Transformer1D(BaseModule):
 
         self.gradient_checkpointing = self.cfg.gradient_checkpointing
 
+        self._prefix_cache: Dict = {}
+        self.set_attention_processor(
+            self.cfg.attention_processor, self.cfg.attention_slice_size
+        )
+        self.set_chunk_feed_forward(self.cfg.feed_forward_chunk_size)
+        self.set_token_merge(self.cfg.token_merge_ratio, self.cfg.token_merge_layers)
+
+    def set_attention_processor(
+        self, processor: str, slice_size: Optional[int] = None
+    ) -> None:
+        if processor not in ATTENTION_PROCESSORS:
+            raise ValueError(
+                f"Unknown attention processor: {processor}, expected one of {ATTENTION_PROCESSORS}"
+            )
+        self.clear_prefix_cache()
+        self.attention_processor = processor
+        if slice_size is not None:
+            self.attention_slice_size = slice_size
+        for module in self.modules():
+            if not isinstance(module, Attention):
+                continue
+            if processor == "sliced":
+                module.set_processor(SlicedAttnProcessor(self.attention_slice_size))
+            elif module.fused_projections:
+                module.set_processor(FusedAttnProcessor2_0())
+            elif hasattr(F, "scaled_dot_product_attention"):
+                module.set_processor(AttnProcessor2_0())
+            else:
+                module.set_processor(AttnProcessor())
+
+    def set_chunk_feed_forward(self, chunk_size: Optional[int]) -> None:
+        # chunks along the token dimension
+        for block in self.transformer_blocks:
+            block.set_chunk_feed_forward(chunk_size, 1)
+
+    def set_token_merge(
+        self, ratio: float, layers: Optional[List[int]] = None
+    ) -> None:
+        # ToMe-style merging, trades quality for latency without retraining
+        if not 0.0 <= ratio < 1.0:
+            raise ValueError(f"Token merge ratio must be in [0, 1), got {ratio}")
+        self.clear_prefix_cache()
+        for i, block in enumerate(self.transformer_blocks):
+            merged = ratio > 0 and (layers is None or i in layers)
+            block.set_token_merge(ratio if merged else None)
+
+    def clear_prefix_cache(self) -> None:
+        # must be called whenever weights or attention settings change
+        self._prefix_cache.clear()
+
+    def forward_prefix(
+        self, hidden_states: torch.Tensor
+    ) -> Optional[Dict[str, torch.Tensor]]:
+        # with input-independent hidden_states (learned triplane tokens)
+        # everything up to the first cross-attention is constant
+        if self.cfg.only_cross_attention:
+            return None
+        batch, _, seq_len = hidden_states.shape
+        residual = hidden_states
+        hidden_states = self.norm(hidden_states)
+        inner_dim = hidden_states.shape[1]
+        hidden_states = hidden_states.permute(0, 2, 1).reshape(
+            batch, seq_len, inner_dim
+        )
+        hidden_states = self.proj_in(hidden_states)
+        block = self.transformer_blocks[0]
+        merge, unmerge = block.token_merge(hidden_states)
+        return {
+            "residual": residual,
+            "hidden_states": hidden_states,
+            "self_attention": block.self_attention(hidden_states, merge, unmerge),
+        }
+
+    def cached_prefix(
+        self, hidden_states: torch.Tensor, key
+    ) -> Optional[Dict[str, torch.Tensor]]:
+        # computed once per key (device, precision) on a batch of one
+        if key not in self._prefix_cache:
+            with torch.no_grad():
+                self._prefix_cache[key] = self.forward_prefix(hidden_states)
+        return self._prefix_cache[key]
+
+    def fuse_qkv_projections(self) -> None:
+        # one GEMM for self-attention Q/K/V and one for cross-attention K/V,
+        # must be called after the weights are loaded
+        if not hasattr(F, "scaled_dot_product_attention"):
+            return
+        for module in self.modules():
+            if isinstance(module, Attention) and not module.fused_projections:
+                module.fuse_projections()
+        self.set_attention_processor(self.attention_processor)
+
     def forward(
         self,
         hidden_states: torch.Tensor,
         encoder_hidden_states: Optional[torch.Tensor] = None,
         attention_mask: Optional[torch.Tensor] = None,
         encoder_attention_mask: Optional[torch.Tensor] = None,
+        prefix: Optional[Dict[str, torch.Tensor]] = None,
     ):
         """
         The [`Transformer1DModel`] forward method.
@@ -177,18 +288,25 @@ class Transformer1D(BaseModule):
             encoder_attention_mask = encoder_attention_mask.unsqueeze(1)
 
         # 1. Input
-        batch, _, seq_len = hidden_states.shape
-        residual = hidden_states
+        if prefix is not None:
+            # precomputed by forward_prefix on a batch of one, broadcast here
+            batch = encoder_hidden_states.shape[0]
+            residual = prefix["residual"]
+            _, inner_dim, seq_len = residual.shape
+            hidden_states = prefix["hidden_states"]
+        else:
+            batch, _, seq_len = hidden_states.shape
+            residual = hidden_states
 
-        hidden_states = self.norm(hidden_states)
-        inner_dim = hidden_states.shape[1]
-        hidden_states = hidden_states.permute(0, 2, 1).reshape(
-            batch, seq_len, inner_dim
-        )
-        hidden_states = self.proj_in(hidden_states)
+            hidden_states = self.norm(hidden_states)
+            inner_dim = hidden_states.shape[1]
+            hidden_states = hidden_states.permute(0, 2, 1).reshape(
+                batch, seq_len, inner_dim
+            )
+            hidden_states = self.proj_in(hidden_states)
 
         # 2. Blocks
-        for block in self.transformer_blocks:
+        for i, block in enumerate(self.transformer_blocks):
             if self.training and self.gradient_checkpointing:
                 hidden_states = torch.utils.checkpoint.checkpoint(
                     block,
@@ -204,6 +322,11 @@ class Transformer1D(BaseModule):
                     attention_mask=attention_mask,
                     encoder_hidden_states=encoder_hidden_states,
                     encoder_attention_mask=encoder_attention_mask,
+                    self_attention_output=(
+                        prefix["self_attention"].expand(batch, -1, -1)
+                        if prefix is not None and i == 0
+                        else None
+                    ),
                 )
 
         # 3. Output
@@ -0,0 +1,157 @@
+import inspect
+import os
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+SCENE_CODES_ONNX = "image_to_triplane.onnx"
+DECODER_ONNX = "decoder.onnx"
+ONNX_OPSET = 17
+
+
+class SceneCodesGraph(nn.Module):
+    # TSR.get_scene_codes on preprocessed (B, H, W, 3) images
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        return self.model.get_scene_codes(images[:, None])
+
+
+class DecoderGraph(nn.Module):
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, features: torch.Tensor):
+        out = self.decoder(features)
+        return out["density"], out["features"]
+
+
+def _export_kwargs() -> Dict:
+    # the TorchScript exporter handles dynamic_axes and the ViT's position
+    # embedding interpolation, newer torch defaults to the dynamo exporter
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        return {"dynamo": False}
+    return {}
+
+
+def export_onnx(model, output_dir: str, opset_version: int = ONNX_OPSET) -> None:
+    """
+    Export TSR.get_scene_codes (image tokenizer, backbone, post-processor) and the
+    NeRFMLP decoder to ONNX graphs with a dynamic batch / point dimension.
+    """
+    if getattr(model, "quantization", None) is not None:
+        raise ValueError("Quantized models cannot be exported to ONNX")
+    if model.precision != "fp32":
+        raise ValueError(f"ONNX export requires fp32 precision, got {model.precision}")
+    if getattr(model.image_tokenizer, "prune_background", False):
+        raise ValueError("ONNX export does not support background token pruning")
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.eval()
+    device = next(model.parameters()).device
+    size = model.cfg.cond_image_size
+    images = torch.rand(2, size, size, 3, device=device)
+    with torch.no_grad():
+        torch.onnx.export(
+            SceneCodesGraph(model),
+            (images,),
+            os.path.join(output_dir, SCENE_CODES_ONNX),
+            input_names=["images"],
+            output_names=["scene_codes"],
+            dynamic_axes={"images": {0: "batch"}, "scene_codes": {0: "batch"}},
+            opset_version=opset_version,
+            do_constant_folding=True,
+            **_export_kwargs(),
+        )
+
+        features = torch.rand(1024, model.decoder.cfg.in_channels, device=device)
+        torch.onnx.export(
+            DecoderGraph(model.decoder),
+            (features,),
+            os.path.join(output_dir, DECODER_ONNX),
+            input_names=["triplane_features"],
+            output_names=["density", "features"],
+            dynamic_axes={
+                "triplane_features": {0: "points"},
+                "density": {0: "points"},
+                "features": {0: "points"},
+            },
+            opset_version=opset_version,
+            do_constant_folding=True,
+            **_export_kwargs(),
+        )
+
+
+def onnx_exported(output_dir: str) -> bool:
+    return all(
+        os.path.exists(os.path.join(output_dir, name))
+        for name in [SCENE_CODES_ONNX, DECODER_ONNX]
+    )
+
+
+class OnnxDecoder(nn.Module):
+    # drop-in for NeRFMLP, used by the renderer through TSR.set_onnx_backend
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        inp_shape = x.shape[:-1]
+        density, features = self.session.run(
+            None,
+            {"triplane_features": x.reshape(-1, x.shape[-1]).float().cpu().numpy()},
+        )
+        return {
+            "density": torch.from_numpy(density).to(x.device).reshape(*inp_shape, -1),
+            "features": torch.from_numpy(features)
+            .to(x.device)
+            .reshape(*inp_shape, -1),
+        }
+
+
+class OnnxRuntimeBackend:
+    """
+    Runs the exported graphs with onnxruntime. Thread counts of 0 let onnxruntime
+    choose; graph optimizations are applied once when the sessions are created.
+    """
+
+    def __init__(
+        self,
+        onnx_dir: str,
+        intra_op_num_threads: int = 0,
+        inter_op_num_threads: int = 0,
+        providers: Optional[List[str]] = None,
+    ):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError(
+                "onnxruntime is required for the ONNX backend, install it with `pip install onnxruntime`"
+            )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads
+        if inter_op_num_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        providers = providers or ["CPUExecutionProvider"]
+
+        self.scene_codes_session = ort.InferenceSession(
+            os.path.join(onnx_dir, SCENE_CODES_ONNX), options, providers=providers
+        )
+        self.decoder = OnnxDecoder(
+            ort.InferenceSession(
+                os.path.join(onnx_dir, DECODER_ONNX), options, providers=providers
+            )
+        )
+
+    def get_scene_codes(self, rgb_cond: torch.Tensor) -> torch.Tensor:
+        # rgb_cond: preprocessed (B, 1, H, W, 3) images, as in TSR.forward
+        (scene_codes,) = self.scene_codes_session.run(
+            None, {"images": rgb_cond[:, 0].float().cpu().numpy()}
+        )
+        return torch.from_numpy(scene_codes).to(rgb_cond.device)
@@ -0,0 +1,89 @@
+import os
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+from torch.ao.nn.quantized import dynamic as nnqd
+from torch.ao.quantization import quantize_dynamic
+
+QUANTIZATIONS = ["int8"]
+
+
+def int8_module_names(model) -> List[str]:
+    # every projection of the transformer backbone (to_q/k/v/out, feed-forward,
+    # proj_in/out); in the decoder only the hidden layers, since the input layer
+    # sees raw triplane features and the output head feeds the exponential
+    # density activation
+    names = [
+        f"backbone.{name}"
+        for name, module in model.backbone.named_modules()
+        if isinstance(module, nn.Linear)
+    ]
+    decoder_names = [
+        f"decoder.{name}"
+        for name, module in model.decoder.named_modules()
+        if isinstance(module, nn.Linear)
+    ]
+    return names + decoder_names[1:-1]
+
+
+def quantize_int8(model):
+    """
+    Dynamic int8 quantization (int8 weights, activations quantized per call) of
+    the backbone and decoder linear layers. Quantized models run on CPU only.
+    """
+    names = int8_module_names(model)
+    quantize_dynamic(model, set(names), dtype=torch.qint8, inplace=True)
+    model.quantization = "int8"
+    model.quantized_modules = names
+    return model
+
+
+def checkpoint_fingerprint(path: str) -> Dict[str, int]:
+    # size and modification time, cheap to check on every load unlike a hash
+    # of the multi-gigabyte checkpoint
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def save_quantized(model, path: str, source: str) -> None:
+    # source: the checkpoint the model was quantized from
+    torch.save(
+        {
+            "quantization": model.quantization,
+            "modules": model.quantized_modules,
+            "source": checkpoint_fingerprint(source),
+            "state_dict": model.state_dict(),
+        },
+        path,
+    )
+
+
+def load_quantized(model, path: str, source: str) -> Optional[nn.Module]:
+    """
+    Swap in empty quantized layers and load the stored int8 weights, so the
+    fp32 checkpoint is neither loaded nor quantized again. Returns None and
+    leaves the model untouched if the stored weights were not quantized from
+    the current version of the source checkpoint.
+    """
+    ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    if ckpt.get("source") != checkpoint_fingerprint(source):
+        return None
+    for name in ckpt["modules"]:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        linear = getattr(parent, child_name)
+        setattr(
+            parent,
+            child_name,
+            nnqd.Linear(
+                linear.in_features,
+                linear.out_features,
+                bias_=linear.bias is not None,
+                dtype=torch.qint8,
+            ),
+        )
+    model.load_state_dict(ckpt["state_dict"], assign=True)
+    model.quantization = ckpt["quantization"]
+    model.quantized_modules = ckpt["modules"]
+    return model
@@ -0,0 +1,114 @@
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+LOADING = "loading"
+READY = "ready"
+ERROR = "error"
+
+
+def warmup(
+    model,
+    device: str,
+    resolution: int = 256,
+    has_vertex_color: bool = False,
+    n_views: int = 1,
+    image_size: int = 512,
+) -> None:
+    """
+    Run one dummy request through the model: forward, render and mesh extraction
+    at the production marching cubes resolution. This builds the isosurface grid,
+    tunes an "auto" renderer chunk size and warms up kernels and allocators.
+    """
+    # a preprocessed-looking input: a textured disc on the gray background fill,
+    # so the scene has a surface to extract and background pruning keeps patches
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:image_size, :image_size] / image_size - 0.5
+    disc = (xx**2 + yy**2 < 0.35**2)[..., None]
+    image = np.where(
+        disc, rng.integers(0, 256, (image_size, image_size, 3)), 127
+    ).astype(np.uint8)
+    image = Image.fromarray(image)
+    with torch.no_grad():
+        scene_codes = model([image], device=device)
+        model.render(scene_codes, n_views=n_views, return_type="pt")
+        model.extract_mesh(scene_codes, has_vertex_color, resolution=resolution)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+class ModelLoader:
+    """
+    Loads (and optionally warms up) a model on a background thread, so a server
+    can bind and answer health checks while the weights load. Status goes
+    loading -> ready, or error; while loading, stage is "load" or "warmup".
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[], Any],
+        warmup_fn: Optional[Callable[[Any], None]] = None,
+    ):
+        self.load_fn = load_fn
+        self.warmup_fn = warmup_fn
+        self.status = LOADING
+        self.stage = "load"
+        self.error = None
+        self.timings = {}
+        self._model = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "ModelLoader":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            start = time.time()
+            model = self.load_fn()
+            self.timings["load"] = time.time() - start
+            if self.warmup_fn is not None:
+                self.stage = "warmup"
+                start = time.time()
+                try:
+                    self.warmup_fn(model)
+                except Exception:
+                    # only costs the first request its warm-up, still serve
+                    traceback.print_exc()
+                self.timings["warmup"] = time.time() - start
+            self._model = model
+            self.status = READY
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.status = ERROR
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == READY
+
+    def get(self, timeout: Optional[float] = None):
+        # blocks until the model is ready
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Model is still {self.status}")
+        if self.status == ERROR:
+            raise RuntimeError(f"Model failed to load: {self.error}")
+        return self._model
+
+    def health(self) -> Dict[str, Any]:
+        health = {"status": self.status}
+        if self.status == LOADING:
+            health["stage"] = self.stage
+        for name, seconds in self.timings.items():
+            health[f"{name}_seconds"] = round(seconds, 2)
+        if self.error is not None:
+            health["error"] = self.error
+        return health
@@ -0,0 +1,118 @@
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+
+# number of candidate pixels evaluated per batch
+PIXEL_BUDGET = 1 << 21
+
+
+def _tiles(
+    lo: torch.Tensor, extent: torch.Tensor
+) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+    # group primitives by power-of-two bounding-box size so that every batch
+    # enumerates the same square tile of pixels starting at its bbox corner
+    level = torch.ceil(torch.log2(extent.float())).long()
+    for k in level.unique().tolist():
+        ids = torch.nonzero(level == k).squeeze(1)
+        side = 2**k
+        step = max(1, PIXEL_BUDGET // (side * side))
+        offsets = torch.arange(side, device=lo.device)
+        for i in range(0, ids.shape[0], step):
+            batch = ids[i : i + step]
+            x = lo[batch, 0, None, None] + offsets[None, None, :]
+            y = lo[batch, 1, None, None] + offsets[None, :, None]
+            yield batch, x, y
+
+
+def _pixel_bounds(
+    vmin: torch.Tensor, vmax: torch.Tensor, texture_resolution: int
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # pixels whose centers (i + 0.5) fall within [vmin, vmax]
+    lo = torch.ceil(vmin - 0.5).long().clamp(0, texture_resolution - 1)
+    hi = torch.floor(vmax - 0.5).long().clamp(0, texture_resolution - 1)
+    extent = (hi - lo + 1).max(dim=-1).values
+    valid = ((vmax - 0.5) >= 0).all(-1) & ((vmin - 0.5) <= texture_resolution - 1).all(-1)
+    valid &= (torch.floor(vmax - 0.5) >= torch.ceil(vmin - 0.5)).all(-1)
+    return lo, extent, valid
+
+
+def _write(out, x, y, mask, values, texture_resolution):
+    mask = mask & (x < texture_resolution) & (y < texture_resolution)
+    idx = (y * texture_resolution + x)[mask]
+    out[idx, :3] = values[mask]
+    out[idx, 3] = 1.0
+
+
+def rasterize_position_atlas_torch(
+    positions: np.ndarray,
+    uvs: np.ndarray,
+    indices: np.ndarray,
+    texture_resolution: int,
+    texture_padding: float,
+    device: Optional[torch.device] = None,
+) -> np.ndarray:
+    """
+    Software equivalent of the OpenGL position atlas: rows are v, columns are u,
+    texel (i, j) samples uv ((j + 0.5) / res, (i + 0.5) / res). Triangle edges are
+    first drawn as quads texture_padding pixels wide to build the gutter, then
+    the triangle interiors are drawn on top with barycentric interpolation.
+    """
+    device = device or torch.device("cpu")
+    pos = torch.as_tensor(np.asarray(positions, dtype=np.float32), device=device)
+    uv = torch.as_tensor(np.asarray(uvs, dtype=np.float32), device=device)
+    faces = torch.as_tensor(np.asarray(indices, dtype=np.int64), device=device)
+    faces = faces.view(-1, 3)
+    uv_px = uv * texture_resolution
+
+    out = torch.zeros(
+        (texture_resolution * texture_resolution, 4), dtype=torch.float32, device=device
+    )
+
+    # gutter: every edge as a band of half width padding / 2 along the segment
+    half_width = texture_padding / 2.0
+    edges = faces[:, [0, 1, 1, 2, 2, 0]].view(-1, 2)
+    a, b = uv_px[edges[:, 0]], uv_px[edges[:, 1]]
+    lo, extent, valid = _pixel_bounds(
+        torch.minimum(a, b) - half_width, torch.maximum(a, b) + half_width, texture_resolution
+    )
+    keep = torch.nonzero(valid).squeeze(1)
+    for batch, x, y in _tiles(lo[keep], extent[keep]):
+        e = keep[batch]
+        ea, eb = a[e, None, None], b[e, None, None]
+        ab = eb - ea
+        ab_len2 = (ab * ab).sum(-1).clamp(min=1e-12)
+        px = x.float() + 0.5 - ea[..., 0]
+        py = y.float() + 0.5 - ea[..., 1]
+        t = (px * ab[..., 0] + py * ab[..., 1]) / ab_len2
+        dist = (px * ab[..., 1] - py * ab[..., 0]).abs() / ab_len2.sqrt()
+        mask = (t >= 0) & (t <= 1) & (dist <= half_width)
+        pa, pb = pos[edges[e, 0]], pos[edges[e, 1]]
+        values = torch.lerp(pa[:, None, None], pb[:, None, None], t[..., None])
+        _write(out, x, y, mask, values, texture_resolution)
+
+    # triangle interiors
+    tri = uv_px[faces]
+    lo, extent, valid = _pixel_bounds(
+        tri.min(dim=1).values, tri.max(dim=1).values, texture_resolution
+    )
+    keep = torch.nonzero(valid).squeeze(1)
+    for batch, x, y in _tiles(lo[keep], extent[keep]):
+        f = keep[batch]
+        t0, t1, t2 = (tri[f, i, None, None] for i in range(3))
+        px, py = x.float() + 0.5, y.float() + 0.5
+
+        def edge_function(p0, p1):
+            return (p1[..., 0] - p0[..., 0]) * (py - p0[..., 1]) - (
+                p1[..., 1] - p0[..., 1]
+            ) * (px - p0[..., 0])
+
+        w0, w1, w2 = edge_function(t1, t2), edge_function(t2, t0), edge_function(t0, t1)
+        area = w0 + w1 + w2
+        mask = ((w0 >= 0) & (w1 >= 0) & (w2 >= 0)) | ((w0 <= 0) & (w1 <= 0) & (w2 <= 0))
+        mask &= area != 0
+        bary = torch.stack([w0, w1, w2], dim=-1) / torch.where(area == 0, 1.0, area)[..., None]
+        values = torch.einsum("bhwk,bkc->bhwc", bary, pos[faces[f]])
+        _write(out, x, y, mask, values, texture_resolution)
+
+    return out.view(texture_resolution, texture_resolution, 4).cpu().numpy()
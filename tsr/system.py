@@ -1,26 +1,32 @@
 import math
 import os
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import List, Optional, Union
 
 import numpy as np
 import PIL.Image
 import torch
 import torch.nn.functional as F
-import trimesh
 from einops import rearrange
-from huggingface_hub import hf_hub_download
 from omegaconf import OmegaConf
 from PIL import Image
 
+from .mesh import Mesh
 from .models.isosurface import MarchingCubeHelper
+from .quantization import QUANTIZATIONS, load_quantized, quantize_int8, save_quantized
 from .utils import (
+    PRECISIONS,
     BaseModule,
     ImagePreprocessor,
+    autocast,
     find_class,
     get_spherical_cameras,
     scale_tensor,
 )
+from .weights import load_checkpoint
+
+# smallest grid the memory planner will downgrade to
+MIN_MC_RESOLUTION = 64
 
 
 class TSR(BaseModule):
@@ -50,25 +56,88 @@ class TSR(BaseModule):
 
     @classmethod
     def from_pretrained(
-        cls, pretrained_model_name_or_path: str, config_name: str, weight_name: str
+        cls,
+        pretrained_model_name_or_path: str,
+        config_name: str,
+        weight_name: str,
+        precision: str = "fp32",
+        quantization: Optional[str] = None,
+        device: Union[str, torch.device] = "cpu",
     ):
         if os.path.isdir(pretrained_model_name_or_path):
             config_path = os.path.join(pretrained_model_name_or_path, config_name)
             weight_path = os.path.join(pretrained_model_name_or_path, weight_name)
         else:
+            from huggingface_hub import hf_hub_download
+
             config_path = hf_hub_download(
                 repo_id=pretrained_model_name_or_path, filename=config_name
             )
+            weight_path = None
+
+        cfg = OmegaConf.load(config_path)
+        OmegaConf.resolve(cfg)
+        # parameters are only allocated when the checkpoint is assigned, which
+        # skips random initialization and the copy into initialized tensors
+        with torch.device("meta"):
+            model = cls(cfg)
+
+        # weights converted with `python -m tsr.weights` are memory-mapped from
+        # the page cache and shared by every process on the host
+        safetensors_path = os.path.join(
+            os.path.dirname(config_path),
+            f"{os.path.splitext(weight_name)[0]}.safetensors",
+        )
+        if os.path.exists(safetensors_path):
+            weight_path = safetensors_path
+        elif weight_path is None:
             weight_path = hf_hub_download(
                 repo_id=pretrained_model_name_or_path, filename=weight_name
             )
 
-        cfg = OmegaConf.load(config_path)
-        OmegaConf.resolve(cfg)
-        model = cls(cfg)
-        ckpt = torch.load(weight_path, map_location="cpu")
-        model.load_state_dict(ckpt)
-        return model
+        quantized_path = None
+        if quantization is not None:
+            if quantization not in QUANTIZATIONS:
+                raise ValueError(
+                    f"Unknown quantization: {quantization}, expected one of {QUANTIZATIONS}"
+                )
+            if torch.device(device).type != "cpu":
+                raise ValueError("Quantized models only run on CPU")
+            # the quantized profile is stored next to the config on first use,
+            # and redone when the checkpoint it was made from changes
+            quantized_path = os.path.join(
+                os.path.dirname(config_path),
+                f"{os.path.splitext(weight_name)[0]}.{quantization}.pt",
+            )
+            if os.path.exists(quantized_path):
+                if load_quantized(model, quantized_path, weight_path) is not None:
+                    model.to(device)
+                    model.set_precision(precision)
+                    # inference mode, enables the backbone prefix cache
+                    return model.eval()
+                print(
+                    f"{quantized_path} was quantized from another version of "
+                    f"{weight_path}, quantizing again"
+                )
+
+        model.load_state_dict(load_checkpoint(weight_path, device), assign=True)
+        # non-persistent buffers are created on the CPU
+        model.to(device)
+        if quantized_path is not None:
+            quantize_int8(model)
+            try:
+                save_quantized(model, quantized_path, weight_path)
+            except OSError as e:
+                print(f"Could not save quantized weights to {quantized_path}: {e}")
+        elif not (
+            weight_path.endswith(".safetensors") and torch.device(device).type == "cpu"
+        ):
+            # safetensors weights on the CPU stay file-backed and shared between
+            # processes, fused projections would be private copies
+            model.backbone.fuse_qkv_projections()
+        model.set_precision(precision)
+        # inference mode, enables the backbone prefix cache
+        return model.eval()
 
     def configure(self):
         self.image_tokenizer = find_class(self.cfg.image_tokenizer_cls)(
@@ -83,6 +152,33 @@ class TSR(BaseModule):
         self.renderer = find_class(self.cfg.renderer_cls)(self.cfg.renderer)
         self.image_processor = ImagePreprocessor()
         self.isosurface_helper = None
+        self.precision = "fp32"
+        self.onnx_backend = None
+
+    def set_precision(self, precision: str):
+        # "bf16" / "fp16" run the tokenizers, backbone and decoder under autocast
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Unknown precision: {precision}, expected one of {list(PRECISIONS)}"
+            )
+        self.precision = precision
+        self.renderer.set_autocast_dtype(PRECISIONS[precision])
+
+    def set_onnx_backend(self, backend) -> None:
+        # run the image-to-triplane network and the decoder through
+        # onnxruntime (see tsr.onnx_export) instead of PyTorch, None switches
+        # back; the PyTorch modules are kept either way
+        self.onnx_backend = backend
+        if self.renderer.auto_chunk_size:
+            # tuned chunk sizes were profiled with the other decoder
+            self.renderer.set_chunk_size("auto", self.renderer.memory_budget)
+
+    @property
+    def active_decoder(self):
+        # the decoder rendering and mesh extraction query
+        if self.onnx_backend is not None:
+            return self.onnx_backend.decoder
+        return self.decoder
 
     def forward(
         self,
@@ -99,25 +195,59 @@ class TSR(BaseModule):
         rgb_cond = self.image_processor(image, self.cfg.cond_image_size)[:, None].to(
             device
         )
+        mask_cond = None
+        if rgb_cond.shape[-1] == 4:
+            # RGBA input (e.g. straight from remove_background/resize_foreground):
+            # composite onto the gray background fill and keep the alpha as the
+            # foreground mask for background pruning
+            rgb_cond, mask_cond = rgb_cond[..., :3], rgb_cond[..., 3:]
+            rgb_cond = rgb_cond * mask_cond + (1 - mask_cond) * 0.5
+        if self.onnx_backend is not None:
+            return self.onnx_backend.get_scene_codes(rgb_cond)
+        return self.get_scene_codes(rgb_cond, mask_cond)
+
+    def get_scene_codes(
+        self,
+        rgb_cond: torch.FloatTensor,
+        mask_cond: Optional[torch.FloatTensor] = None,
+    ) -> torch.FloatTensor:
+        # rgb_cond: preprocessed (B, 1, H, W, 3) images
+        # mask_cond: optional (B, 1, H, W, 1) foreground alpha
         batch_size = rgb_cond.shape[0]
 
-        input_image_tokens: torch.Tensor = self.image_tokenizer(
-            rearrange(rgb_cond, "B Nv H W C -> B Nv C H W", Nv=1),
-        )
+        with autocast(rgb_cond.device.type, PRECISIONS[self.precision]):
+            input_image_tokens: torch.Tensor = self.image_tokenizer(
+                rearrange(rgb_cond, "B Nv H W C -> B Nv C H W", Nv=1),
+                masks=None
+                if mask_cond is None
+                else rearrange(mask_cond, "B Nv H W C -> B Nv C H W", Nv=1),
+            )
 
-        input_image_tokens = rearrange(
-            input_image_tokens, "B Nv C Nt -> B (Nv Nt) C", Nv=1
-        )
+            input_image_tokens = rearrange(
+                input_image_tokens, "B Nv C Nt -> B (Nv Nt) C", Nv=1
+            )
 
-        tokens: torch.Tensor = self.tokenizer(batch_size)
+            if self.training:
+                tokens: torch.Tensor = self.tokenizer(batch_size)
+                prefix = None
+            else:
+                # the triplane tokens are a learned constant, so the backbone's
+                # input projection and first self-attention are cached per
+                # device and precision and broadcast over the batch
+                tokens = self.tokenizer(1)
+                prefix = self.backbone.cached_prefix(
+                    tokens, (rgb_cond.device, self.precision)
+                )
 
-        tokens = self.backbone(
-            tokens,
-            encoder_hidden_states=input_image_tokens,
-        )
+            tokens = self.backbone(
+                tokens,
+                encoder_hidden_states=input_image_tokens,
+                prefix=prefix,
+            )
 
-        scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
-        return scene_codes
+            scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
+        # scene codes are kept in fp32 for extraction and rendering
+        return scene_codes.float()
 
     def render(
         self,
@@ -153,7 +283,7 @@ class TSR(BaseModule):
             for i in range(n_views):
                 with torch.no_grad():
                     image = self.renderer(
-                        self.decoder, scene_code, rays_o[i], rays_d[i]
+                        self.active_decoder, scene_code, rays_o[i], rays_d[i]
                     )
                 images_.append(process_output(image))
             images.append(images_)
@@ -168,21 +298,72 @@ class TSR(BaseModule):
             return
         self.isosurface_helper = MarchingCubeHelper(resolution)
 
-    def extract_mesh(self, scene_codes, has_vertex_color, resolution: int = 256, threshold: float = 25.0):
+    def plan_marching_cubes_resolution(
+        self, scene_code, resolution: int, memory_policy: str = "downgrade"
+    ) -> int:
+        # only enforced when the renderer manages its own memory budget
+        if not self.renderer.auto_chunk_size:
+            return resolution
+        assert memory_policy in ["downgrade", "refuse"]
+        profile = self.renderer.profile_chunk_sizes(self.active_decoder, scene_code)
+        # per voxel: the host grid and its scaled copy, the query outputs (written
+        # into chunk_batch's preallocated tensors, no concatenation copy) and the
+        # level field with its temporary
+        bytes_per_voxel = 6 * 4 + profile["output_bytes_per_point"] + 2 * 4
+        chunk_size = self.renderer.get_chunk_size(
+            self.active_decoder, scene_code, resolution**3
+        )
+        working = chunk_size * profile["bytes_per_point"]
+        budget = self.renderer.get_memory_budget(scene_code.device)
+        max_resolution = int((max(budget - working, 0) / bytes_per_voxel) ** (1 / 3))
+        if resolution <= max_resolution:
+            return resolution
+        if memory_policy == "refuse" or max_resolution < MIN_MC_RESOLUTION:
+            raise MemoryError(
+                f"Marching cubes resolution {resolution} needs about "
+                f"{resolution ** 3 * bytes_per_voxel / 2**30:.1f} GiB, "
+                f"memory budget allows at most {max_resolution}"
+            )
+        print(
+            f"Marching cubes resolution {resolution} exceeds the memory budget, "
+            f"using {max_resolution} instead"
+        )
+        return max_resolution
+
+    def extract_mesh(
+        self,
+        scene_codes,
+        has_vertex_color,
+        resolution: int = 256,
+        threshold: float = 25.0,
+        has_vertex_normal: bool = False,
+        memory_policy: str = "downgrade",
+    ):
+        resolution = self.plan_marching_cubes_resolution(
+            scene_codes[0], resolution, memory_policy
+        )
         self.set_marching_cubes_resolution(resolution)
         meshes = []
+        # the grid stays on the host and is streamed to the scene code's device
+        grid_vertices = scale_tensor(
+            self.isosurface_helper.grid_vertices,
+            self.isosurface_helper.points_range,
+            (-self.renderer.cfg.radius, self.renderer.cfg.radius),
+        )
         for scene_code in scene_codes:
             with torch.no_grad():
                 density = self.renderer.query_triplane(
-                    self.decoder,
-                    scale_tensor(
-                        self.isosurface_helper.grid_vertices.to(scene_codes.device),
-                        self.isosurface_helper.points_range,
-                        (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-                    ),
+                    self.active_decoder,
+                    grid_vertices,
                     scene_code,
+                    output_device=scene_codes.device,
                 )["density_act"]
-            v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
+            level = -(density - threshold)
+            v_pos, t_pos_idx = self.isosurface_helper(level)
+            normal = None
+            if has_vertex_normal:
+                # smooth normals from the density gradient on the extraction grid
+                normal = self.isosurface_helper.vertex_normals(level, v_pos)
             v_pos = scale_tensor(
                 v_pos,
                 self.isosurface_helper.points_range,
@@ -192,14 +373,18 @@ class TSR(BaseModule):
             if has_vertex_color:
                 with torch.no_grad():
                     color = self.renderer.query_triplane(
-                        self.decoder,
+                        self.active_decoder,
                         v_pos,
                         scene_code,
+                        output_device="cpu",
                     )["color"]
-            mesh = trimesh.Trimesh(
+            # marching cubes already shares vertices along cell edges, so skip
+            # trimesh's merge/cleanup pass; use Mesh.to_trimesh() when needed
+            mesh = Mesh(
                 vertices=v_pos.cpu().numpy(),
                 faces=t_pos_idx.cpu().numpy(),
                 vertex_colors=color.cpu().numpy() if has_vertex_color else None,
+                vertex_normals=normal.cpu().numpy() if has_vertex_normal else None,
             )
             meshes.append(mesh)
         return meshes
@@ -1,17 +1,15 @@
 import importlib
 import math
+import os
 from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-import imageio
 import numpy as np
 import PIL.Image
-import rembg
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import trimesh
 from omegaconf import DictConfig, OmegaConf
 from PIL import Image
 
@@ -162,10 +160,16 @@ def chunk_batch(func: Callable, chunk_size: int, *args, **kwargs) -> Any:
     assert (
         B is not None
     ), "No tensor found in args or kwargs, cannot determine batch size."
-    out = defaultdict(list)
+    # outputs are written into tensors preallocated from the first chunk's
+    # shapes; values whose leading dim does not follow the chunk are concatenated
+    keys: List[Any] = []
+    out: Dict[Any, torch.Tensor] = {}
+    out_lists = defaultdict(list)
+    none_keys = set()
     out_type = None
     # max(1, B) to support B == 0
     for i in range(0, max(1, B), chunk_size):
+        n = min(chunk_size, B - i)
         out_chunk = func(
             *[
                 arg[i : i + chunk_size] if isinstance(arg, torch.Tensor) else arg
@@ -191,24 +195,55 @@ def chunk_batch(func: Callable, chunk_size: int, *args, **kwargs) -> Any:
                 f"Return value of func must be in type [torch.Tensor, list, tuple, dict], get {type(out_chunk)}."
             )
             exit(1)
-        for k, v in out_chunk.items():
+        for k in out_chunk:
+            if k not in keys:
+                if i > 0:
+                    # missing from the earlier chunks, same as None there
+                    none_keys.add(k)
+                keys.append(k)
+        for k in keys:
+            v = out_chunk.get(k)
+            if v is None:
+                if k in out or k in out_lists:
+                    raise TypeError(
+                        f"Return value {k!r} of func is a tensor in some chunks and None in others"
+                    )
+                none_keys.add(k)
+                continue
+            if not isinstance(v, torch.Tensor):
+                raise TypeError(
+                    f"Unsupported types in return value of func: {type(v)}"
+                )
+            if k in none_keys:
+                # the rows of the earlier chunks would stay uninitialized
+                raise TypeError(
+                    f"Return value {k!r} of func is None in some chunks and a tensor in others"
+                )
             v = v if torch.is_grad_enabled() else v.detach()
-            out[k].append(v)
+            if k in out_lists:
+                out_lists[k].append(v)
+            elif v.ndim > 0 and v.shape[0] == n:
+                if k not in out:
+                    out[k] = torch.empty(
+                        (B, *v.shape[1:]), dtype=v.dtype, device=v.device
+                    )
+                out[k][i : i + n] = v
+            else:
+                # leading dim does not follow the chunk, concatenate instead
+                if k in out:
+                    out_lists[k].append(out.pop(k)[:i])
+                out_lists[k].append(v)
 
     if out_type is None:
         return None
 
     out_merged: Dict[Any, Optional[torch.Tensor]] = {}
-    for k, v in out.items():
-        if all([vv is None for vv in v]):
-            # allow None in return value
-            out_merged[k] = None
-        elif all([isinstance(vv, torch.Tensor) for vv in v]):
-            out_merged[k] = torch.cat(v, dim=0)
+    for k in keys:
+        if k in out_lists:
+            out_merged[k] = torch.cat(out_lists[k], dim=0)
         else:
-            raise TypeError(
-                f"Unsupported types in return value of func: {[type(vv) for vv in v if not isinstance(vv, torch.Tensor)]}"
-            )
+            # allow None in return value
+            out_merged[k] = out.get(k)
 
     if out_type is torch.Tensor:
         return out_merged[0]
@@ -218,6 +253,106 @@ def chunk_batch(func: Callable, chunk_size: int, *args, **kwargs) -> Any:
         return out_merged
 
 
+def stream_batch(
+    func: Callable[[torch.Tensor], Dict[str, torch.Tensor]],
+    chunk_size: int,
+    inputs: torch.Tensor,
+    device: Union[str, torch.device],
+    output_device: Union[str, torch.device],
+) -> Dict[str, torch.Tensor]:
+    """
+    Run func over chunks of inputs on device, returning outputs on output_device.
+    On CUDA, host inputs are staged through double-buffered pinned memory and
+    copied on a side stream, and host outputs are copied back on another stream
+    into pinned buffers, so transfers overlap with compute. Elsewhere this is
+    plain chunking.
+    """
+    device, output_device = torch.device(device), torch.device(output_device)
+    B = inputs.shape[0]
+    if chunk_size <= 0:
+        chunk_size = max(1, B)
+    if device.type != "cuda":
+        out = chunk_batch(lambda x: func(x.to(device)), chunk_size, inputs)
+        return {k: v.to(output_device) for k, v in out.items()}
+
+    compute_stream = torch.cuda.current_stream(device)
+    h2d_stream = torch.cuda.Stream(device)
+    d2h_stream = torch.cuda.Stream(device)
+    stage_inputs = inputs.device.type == "cpu"
+    to_host = output_device.type == "cpu"
+    if stage_inputs:
+        staging = [
+            torch.empty(
+                (min(chunk_size, B), *inputs.shape[1:]),
+                dtype=inputs.dtype,
+                pin_memory=True,
+            )
+            for _ in range(2)
+        ]
+        staging_free = [None, None]
+
+    out: Dict[str, torch.Tensor] = {}
+    for j, i in enumerate(range(0, max(1, B), chunk_size)):
+        n = min(chunk_size, B - i)
+        if stage_inputs:
+            slot = j % 2
+            if staging_free[slot] is not None:
+                # the previous upload from this buffer must have finished
+                staging_free[slot].synchronize()
+            staging[slot][:n].copy_(inputs[i : i + n])
+            with torch.cuda.stream(h2d_stream):
+                x = staging[slot][:n].to(device, non_blocking=True)
+                staging_free[slot] = torch.cuda.Event()
+                staging_free[slot].record(h2d_stream)
+            compute_stream.wait_stream(h2d_stream)
+            x.record_stream(compute_stream)
+        else:
+            x = inputs[i : i + n].to(device)
+
+        out_chunk = func(x)
+        if not out:
+            out = {
+                k: torch.empty(
+                    (B, *v.shape[1:]),
+                    dtype=v.dtype,
+                    device=output_device,
+                    pin_memory=to_host,
+                )
+                for k, v in out_chunk.items()
+            }
+        if to_host:
+            d2h_stream.wait_stream(compute_stream)
+            with torch.cuda.stream(d2h_stream):
+                for k, v in out_chunk.items():
+                    out[k][i : i + n].copy_(v, non_blocking=True)
+                    v.record_stream(d2h_stream)
+        else:
+            for k, v in out_chunk.items():
+                out[k][i : i + n] = v.to(output_device)
+
+    if to_host:
+        d2h_stream.synchronize()
+    return out
+
+
+def get_available_memory(device: Union[str, torch.device]) -> int:
+    # free bytes on the device, host RAM for CPU
+    device = torch.device(device)
+    if device.type == "cuda":
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 4 << 30
+
+
 ValidScale = Union[Tuple[float, float], torch.FloatTensor]
 
 
@@ -233,6 +368,16 @@ def scale_tensor(dat: torch.FloatTensor, inp_scale: ValidScale, tgt_scale: Valid
     return dat
 
 
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def autocast(device_type: str, dtype: Optional[torch.dtype]):
+    # fp16 autocast is a GPU path, CPUs run reduced precision in bf16
+    if dtype is torch.float16 and device_type == "cpu":
+        dtype = torch.bfloat16
+    return torch.autocast(device_type, dtype=dtype, enabled=dtype is not None)
+
+
 def get_activation(name) -> Callable:
     if name is None:
         return lambda x: x
@@ -410,6 +555,9 @@ def remove_background(
         do_remove = False
     do_remove = do_remove or force
     if do_remove:
+        # rembg pulls in onnxruntime and its model zoo, import on first use
+        import rembg
+
         image = rembg.remove(image, session=rembg_session, **rembg_kwargs)
     return image
 
@@ -461,6 +609,8 @@ def save_video(
     fps: int = 30,
 ):
     # use imageio to save video
+    import imageio
+
     frames = [np.array(frame) for frame in frames]
     writer = imageio.get_writer(output_path, fps=fps)
     for frame in frames:
@@ -469,6 +619,8 @@ def save_video(
 
 
 def to_gradio_3d_orientation(mesh):
+    import trimesh
+
     mesh.apply_transform(trimesh.transformations.rotation_matrix(-np.pi/2, [1, 0, 0]))
     mesh.apply_transform(trimesh.transformations.rotation_matrix(np.pi/2, [0, 1, 0]))
     return mesh
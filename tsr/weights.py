@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import struct
+from typing import Dict, Union
+
+import torch
+
+# safetensors dtype names
+DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+DTYPE_NAMES = {v: k for k, v in DTYPES.items()}
+
+
+def save_safetensors(state_dict: Dict[str, torch.Tensor], path: str) -> None:
+    """
+    Write a state dict in the safetensors format. Tensors are laid out largest
+    element size first, so every tensor stays aligned for memory mapping.
+    """
+    names = sorted(state_dict, key=lambda k: (-state_dict[k].element_size(), k))
+    header, offset = {}, 0
+    for name in names:
+        tensor = state_dict[name]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": DTYPE_NAMES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+    header["__metadata__"] = {"format": "pt"}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name in names:
+            tensor = state_dict[name].detach().cpu().contiguous()
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_safetensors(
+    path: str, device: Union[str, torch.device] = "cpu"
+) -> Dict[str, torch.Tensor]:
+    """
+    Memory-map a safetensors file. On the CPU the tensors are copy-on-write views
+    of the file mapping, so processes loading the same file share its pages
+    through the page cache; other devices get a copy of each tensor.
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+    storage = torch.UntypedStorage.from_file(
+        path, shared=False, nbytes=os.path.getsize(path)
+    )
+
+    state_dict = {}
+    for name, info in header.items():
+        dtype = DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        item_size = torch.empty(0, dtype=dtype).element_size()
+        if (data_start + start) % item_size == 0:
+            tensor = torch.empty(0, dtype=dtype).set_(
+                storage, (data_start + start) // item_size, info["shape"]
+            )
+        else:
+            # unaligned files written by other tools
+            tensor = (
+                torch.empty(0, dtype=torch.uint8)
+                .set_(storage, data_start + start, [end - start])
+                .clone()
+                .view(dtype)
+                .reshape(info["shape"])
+            )
+        state_dict[name] = tensor.to(device)
+    return state_dict
+
+
+def load_checkpoint(path: str, device: Union[str, torch.device] = "cpu"):
+    if path.endswith(".safetensors"):
+        return load_safetensors(path, device)
+    # memory-map the checkpoint so tensors are read straight to the target
+    # device, legacy (non-zip) checkpoints cannot be mapped
+    try:
+        return torch.load(path, map_location=device, mmap=True)
+    except RuntimeError:
+        return torch.load(path, map_location=device)
+
+
+def convert_checkpoint(ckpt_path: str, output_path: str = None) -> str:
+    # model.ckpt -> model.safetensors next to it, picked up by TSR.from_pretrained
+    if output_path is None:
+        output_path = os.path.splitext(ckpt_path)[0] + ".safetensors"
+    save_safetensors(load_checkpoint(ckpt_path), output_path)
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a TSR checkpoint to the memory-mappable safetensors format."
+    )
+    parser.add_argument("checkpoint", type=str, help="Path to model.ckpt.")
+    parser.add_argument(
+        "output",
+        type=str,
+        nargs="?",
+        default=None,
+        help="Output path. Default: the checkpoint path with a .safetensors extension",
+    )
+    args = parser.parse_args()
+    print(f"Saved {convert_checkpoint(args.checkpoint, args.output)}")